@@ -6,13 +6,21 @@ ssh-agent) for host resolution, authentication, and host key verification.
 
 import asyncio
 import atexit
+import bisect
+import hashlib
 import logging
-import re
+import os
+import posixpath
+import shlex
+import tempfile
 import uuid
-from time import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from time import perf_counter, time
 
 import asyncssh
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
 
 logger = logging.getLogger("ssh_mcp")
 logging.getLogger("asyncssh").setLevel(logging.WARNING)
@@ -20,81 +28,1198 @@ logging.getLogger("asyncssh").setLevel(logging.WARNING)
 mcp = FastMCP("ssh_mcp")
 
 SESSION_TIMEOUT = 1800  # 30 minutes
-MAX_SESSIONS = 10
+MAX_SESSIONS = 256  # least-recently-used session is evicted beyond this
+SESSION_REAP_INTERVAL = 60  # background expiry sweep
 
-# In-memory session store: {session_id: {conn, host, cwd, last_used}}
-_sessions: dict[str, dict] = {}
+# Connection pool: channels (commands, sessions) share connections per host
+POOL_MAX_CONNECTIONS_PER_HOST = 4
+POOL_MAX_CHANNELS_PER_CONNECTION = 8  # stays below OpenSSH's default MaxSessions of 10
+POOL_IDLE_TIMEOUT = 300  # close connections with no open channels after 5 minutes
+POOL_REAP_INTERVAL = 60  # background idle sweep across all hosts
+POOL_KEEPALIVE_INTERVAL = 30  # dead connections are detected and closed by asyncssh keepalives
 
-# Only allow safe path characters to prevent command injection via cwd
-_SAFE_PATH_RE = re.compile(r"^[a-zA-Z0-9/_\-.~]+$")
+MAX_FANOUT_HOSTS = 500
 
+# Command output is streamed into bounded buffers: only the first and last bytes are returned
+OUTPUT_HEAD_BYTES = 16 * 1024
+OUTPUT_TAIL_BYTES = 16 * 1024
+OUTPUT_MAX_BYTES = 64 * 1024 * 1024  # default point at which reading stops and the command is abandoned
+SPOOL_DIR = os.environ.get("SSH_MCP_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "ssh-mcp-spool"))
 
-def _validate_path(path: str) -> str:
-    """Validate a path contains only safe characters."""
-    if not path or not _SAFE_PATH_RE.match(path):
-        raise ValueError(f"Invalid path: contains unsafe characters")
-    if ".." in path.split("/"):
-        raise ValueError(f"Invalid path: directory traversal not allowed")
-    return path
+# Background jobs: output is kept in a per-job ring buffer and spooled in full to SPOOL_DIR
+MAX_RUNNING_JOBS = 64
+JOB_BUFFER_BYTES = 1024 * 1024
+JOB_RETENTION = 3600  # finished jobs are forgotten after an hour
+JOB_TAIL_MAX_BYTES = 64 * 1024
+JOB_SPOOL_MAX_BYTES = 256 * 1024 * 1024  # spooling stops here; the ring buffer keeps the latest output
 
+# SFTP transfers: asyncssh splits each file into parallel block requests; several files move at once
+SFTP_MAX_REQUESTS = 128  # outstanding read/write requests per file
+SFTP_PARALLEL_FILES = 8
+SFTP_HASH_BATCH = 100  # files per remote sha256sum call when comparing checksums
+SFTP_COMPRESSION_ALGS = ("zlib@openssh.com", "zlib", "none")  # falls back to none if the server refuses
+TRANSFER_DIR = os.environ.get("SSH_MCP_TRANSFER_DIR", "transfers")  # local side of every transfer stays in here
 
-async def _connect(host: str) -> asyncssh.SSHClientConnection:
+# Latency histogram bucket upper bounds, in seconds
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class _OutputLimitReached(Exception):
+    """More output was produced than the caller's max_output_bytes."""
+
+
+class _OutputCapture:
+    """Bounded capture of one output stream: head and tail bytes, total size and SHA-256.
+
+    With a spool path, every byte is also written to that local file as it arrives.
+    """
+
+    def __init__(self, spool_path: str | None = None):
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self._sha256 = hashlib.sha256()
+        self.spool_path = spool_path
+        self._spool = os.fdopen(os.open(spool_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") if spool_path else None
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        self.total += len(data)
+        self._sha256.update(data)
+        if self._spool is not None:
+            self._spool.write(data)
+        room = OUTPUT_HEAD_BYTES - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > OUTPUT_TAIL_BYTES:
+                del self.tail[:len(self.tail) - OUTPUT_TAIL_BYTES]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + len(self.tail)
+
+    def text(self) -> str:
+        if not self.truncated:
+            return (self.head + self.tail).decode("utf-8", errors="replace")
+        omitted = self.total - len(self.head) - len(self.tail)
+        return (self.head.decode("utf-8", errors="replace") + f"\n... [{omitted} bytes omitted] ...\n"
+                + self.tail.decode("utf-8", errors="replace"))
+
+    def info(self) -> dict:
+        info = {"bytes": self.total, "sha256": self._sha256.hexdigest(), "truncated": self.truncated}
+        if self.spool_path:
+            info["spool_path"] = self.spool_path
+        return info
+
+    def close(self) -> None:
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+def _new_captures(spool: bool) -> tuple[_OutputCapture, _OutputCapture]:
+    if not spool:
+        return _OutputCapture(), _OutputCapture()
+    os.makedirs(SPOOL_DIR, mode=0o700, exist_ok=True)
+    base = os.path.join(SPOOL_DIR, uuid.uuid4().hex)
+    return _OutputCapture(f"{base}.stdout"), _OutputCapture(f"{base}.stderr")
+
+
+def _output_response(stdout: _OutputCapture, stderr: _OutputCapture, limit_reached: bool = False) -> dict:
+    """stdout/stderr text, plus size/hash details when output was cut short or spooled."""
+    for capture in (stdout, stderr):
+        capture.close()
+    response = {"stdout": stdout.text().strip(), "stderr": stderr.text().strip()}
+    if limit_reached or stdout.truncated or stderr.truncated or stdout.spool_path:
+        response["output"] = {"stdout": stdout.info(), "stderr": stderr.info(), "limit_reached": limit_reached}
+    return response
+
+
+async def _pump(reader, capture: _OutputCapture, captures: tuple[_OutputCapture, ...], max_bytes: int) -> None:
+    """Copy a stream into capture until EOF, raising once captures together exceed max_bytes."""
+    while chunk := await reader.read(65536):
+        capture.write(chunk)
+        if sum(c.total for c in captures) > max_bytes:
+            raise _OutputLimitReached()
+
+
+class _Histogram:
+    """Latency histogram with fixed cumulative buckets, as in Prometheus."""
+
+    def __init__(self):
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket, as Prometheus' histogram_quantile does."""
+        rank, seen, lower = q * self.count, 0, 0.0
+        for bound, n in zip(METRICS_BUCKETS, self.counts):
+            if n and seen + n >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / n, self.max)
+            seen, lower = seen + n, bound
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "sum_seconds": round(self.sum, 6), "p50_ms": round(self.quantile(0.5) * 1000, 3),
+                "p99_ms": round(self.quantile(0.99) * 1000, 3), "max_ms": round(self.max * 1000, 3)}
+
+
+class _Metrics:
+    """Per-phase latency histograms (all hosts together) and per-host counters.
+
+    Phases: dns_tcp, kex and auth make up connect; pool_acquire (which includes any connect),
+    channel_open and command make up execute; session_command is a command in a persistent shell.
+    """
+
+    COUNTERS = ("connections_opened", "connections_reused", "connect_errors", "commands", "timeouts", "errors",
+                "bytes_received", "bytes_sent")
+
+    def __init__(self):
+        self.phases: dict[str, _Histogram] = {}
+        self.hosts: dict[str, dict[str, int]] = {}
+        self.started = time()
+
+    def observe(self, phase: str, seconds: float) -> None:
+        self.phases.setdefault(phase, _Histogram()).observe(seconds)
+
+    def count(self, host: str, counter: str, n: int = 1) -> None:
+        counters = self.hosts.setdefault(host, dict.fromkeys(self.COUNTERS, 0))
+        counters[counter] += n
+
+    def gauges(self) -> dict:
+        pools = [_pool.stats(), _compressed_pool.stats()]
+        return {
+            "sessions_active": len(_sessions._sessions),
+            "connections_open": sum(s["connections"] for stats in pools for s in stats.values()),
+            "channels_in_use": sum(s["channels"] for stats in pools for s in stats.values()),
+            "jobs_running": sum(1 for job in _jobs.values() if not job.done),
+        }
+
+    def snapshot(self) -> dict:
+        return {"uptime_seconds": round(time() - self.started, 1), "gauges": self.gauges(),
+                "phases": {phase: h.snapshot() for phase, h in sorted(self.phases.items())},
+                "hosts": {host: dict(counters) for host, counters in sorted(self.hosts.items())}}
+
+    def prometheus(self) -> str:
+        """Render in the Prometheus text exposition format (version 0.0.4)."""
+        def label(value: str) -> str:
+            return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+        lines = ["# HELP ssh_mcp_phase_seconds Time spent in each phase of connecting and running commands.",
+                 "# TYPE ssh_mcp_phase_seconds histogram"]
+        for phase, h in sorted(self.phases.items()):
+            cumulative = 0
+            for bound, n in zip((*METRICS_BUCKETS, "+Inf"), h.counts):
+                cumulative += n
+                lines.append(f'ssh_mcp_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'ssh_mcp_phase_seconds_sum{{phase="{phase}"}} {h.sum}')
+            lines.append(f'ssh_mcp_phase_seconds_count{{phase="{phase}"}} {h.count}')
+        for counter in self.COUNTERS:
+            lines += [f"# HELP ssh_mcp_{counter}_total Total {counter.replace('_', ' ')} per host.",
+                      f"# TYPE ssh_mcp_{counter}_total counter"]
+            lines += [f'ssh_mcp_{counter}_total{{host="{label(host)}"}} {counters[counter]}'
+                      for host, counters in sorted(self.hosts.items())]
+        for gauge, value in self.gauges().items():
+            lines += [f"# HELP ssh_mcp_{gauge} Current number of {gauge.replace('_', ' ')}.",
+                      f"# TYPE ssh_mcp_{gauge} gauge", f"ssh_mcp_{gauge} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+_metrics = _Metrics()
+
+
+class _TimedClient(asyncssh.SSHClient):
+    """Marks the end of each connect phase: TCP connected, key exchange done, authenticated."""
+
+    def __init__(self, marks: dict[str, float]):
+        self._marks = marks
+
+    def connection_made(self, conn: asyncssh.SSHClientConnection) -> None:
+        self._marks.setdefault("dns_tcp", perf_counter())
+
+    def begin_auth(self, username: str) -> None:
+        self._marks.setdefault("kex", perf_counter())
+
+    def auth_completed(self) -> None:
+        self._marks.setdefault("auth", perf_counter())
+
+
+async def _connect(host: str, **options) -> asyncssh.SSHClientConnection:
     """Connect using system SSH config (~/.ssh/config, known_hosts, ssh-agent)."""
-    return await asyncssh.connect(host)
+    marks: dict[str, float] = {}
+    started = perf_counter()
+    try:
+        conn = await asyncssh.connect(host, keepalive_interval=POOL_KEEPALIVE_INTERVAL,
+                                      client_factory=lambda: _TimedClient(marks), **options)
+    except Exception:
+        # Not BaseException: a connect cancelled by the caller's timeout is counted as a timeout there
+        _metrics.count(host, "connect_errors")
+        raise
+    previous = started
+    for phase in ("dns_tcp", "kex", "auth"):
+        if phase in marks:
+            _metrics.observe(phase, marks[phase] - previous)
+            previous = marks[phase]
+    _metrics.observe("connect", perf_counter() - started)
+    return conn
+
+
+class _PooledConnection:
+    """A shared connection plus the number of channels currently leased on it."""
+
+    def __init__(self, host: str, conn: asyncssh.SSHClientConnection):
+        self.host = host
+        self.conn = conn
+        self.channels = 0
+        self.opened_channels = 0  # channels ever opened successfully, so > 0 means a reused connection
+        self.broken = False
+        self.last_used = time()
+
+    @property
+    def alive(self) -> bool:
+        return not self.broken and not self.conn.is_closed()
+
 
+class _PoolBusy(Exception):
+    """Every channel slot on a host stayed in use for the whole acquire timeout."""
 
-async def _cleanup_stale():
-    now = time()
-    stale = [sid for sid, s in _sessions.items() if now - s["last_used"] > SESSION_TIMEOUT]
-    for sid in stale:
+
+class _ConnectTimeout(ConnectionError):
+    """Opening a new pooled connection took longer than the acquire timeout."""
+
+
+class _ConnectionPool:
+    """Per-host pool of SSH connections with idle expiry and a per-host connection cap.
+
+    Each acquire() leases one channel slot on a live connection, opening a new connection
+    only when every existing one is full. Callers wait when the host is at its cap.
+    connect_options are passed through to _connect().
+    """
+
+    def __init__(self, **connect_options):
+        self._connect_options = connect_options
+        self._hosts: dict[str, list[_PooledConnection]] = {}
+        self._connecting: dict[str, int] = {}
+        self._waiters: dict[str, deque[asyncio.Future]] = {}
+        self._reaper: asyncio.Task | None = None
+
+    def _close(self, pc: _PooledConnection) -> None:
         try:
-            _sessions[sid]["conn"].close()
+            pc.conn.close()
         except Exception as e:
-            logger.warning("Failed to close stale session %s: %s", sid, e)
-        del _sessions[sid]
+            logger.warning("Failed to close pooled connection to %s: %s", pc.host, e)
 
+    def _reap(self, host: str) -> None:
+        now = time()
+        keep = []
+        for pc in self._hosts.get(host, []):
+            if not pc.alive or (pc.channels == 0 and now - pc.last_used > POOL_IDLE_TIMEOUT):
+                self._close(pc)
+            else:
+                keep.append(pc)
+        self._hosts[host] = keep
 
-def _cleanup_all():
-    """Close all sessions on shutdown."""
-    for sid, s in list(_sessions.items()):
+    def reap(self) -> None:
+        """Close dead and idle connections on every host, not just the one being acquired."""
+        for host in list(self._hosts):
+            self._reap(host)
+            if not self._hosts[host]:
+                del self._hosts[host]
+
+    def _ensure_reaper(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._reaper is None or self._reaper.done() or self._reaper.get_loop() is not loop:
+            self._reaper = loop.create_task(self._reap_forever())
+
+    async def _reap_forever(self) -> None:
+        while True:
+            await asyncio.sleep(POOL_REAP_INTERVAL)
+            self.reap()
+
+    def _wake(self, host: str) -> None:
+        waiters = self._waiters.get(host)
+        while waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+
+    async def acquire(self, host: str, timeout: float | None = None, new_connection: bool = False) -> _PooledConnection:
+        """Lease a channel slot. With a timeout, raise _PoolBusy if no slot frees up in time, or
+        _ConnectTimeout if opening a new connection takes too long. new_connection skips existing ones."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        self._ensure_reaper()
+        self.reap()
+        while True:
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            self._reap(host)
+            conns = self._hosts[host]
+            free = [pc for pc in conns if pc.channels < POOL_MAX_CHANNELS_PER_CONNECTION]
+            if free and not new_connection:
+                pc = min(free, key=lambda c: c.channels)
+                pc.channels += 1
+                _metrics.count(host, "connections_reused")
+                return pc
+            if len(conns) + self._connecting.get(host, 0) < POOL_MAX_CONNECTIONS_PER_HOST:
+                self._connecting[host] = self._connecting.get(host, 0) + 1
+                try:
+                    conn = await asyncio.wait_for(_connect(host, **self._connect_options), remaining)
+                except asyncio.TimeoutError:
+                    raise _ConnectTimeout(f"Timed out after {timeout}s connecting to {host}") from None
+                finally:
+                    self._connecting[host] -= 1
+                    # A failed connect frees a slot someone else may be waiting on
+                    self._wake(host)
+                pc = _PooledConnection(host, conn)
+                pc.channels = 1
+                _metrics.count(host, "connections_opened")
+                self._hosts.setdefault(host, []).append(pc)
+                return pc
+            fut = loop.create_future()
+            self._waiters.setdefault(host, deque()).append(fut)
+            try:
+                await asyncio.wait_for(fut, remaining)
+            except asyncio.TimeoutError:
+                if fut.done() and not fut.cancelled():
+                    self._wake(host)  # pass on a wake-up that arrived as we gave up
+                raise _PoolBusy(
+                    f"Timed out after {timeout}s waiting for a free channel to {host}: all "
+                    f"{POOL_MAX_CONNECTIONS_PER_HOST * POOL_MAX_CHANNELS_PER_CONNECTION} channels are in use "
+                    "by sessions, jobs or other commands."
+                ) from None
+
+    def release(self, pc: _PooledConnection) -> None:
+        pc.channels -= 1
+        pc.last_used = time()
+        if not pc.alive:
+            self._close(pc)
+            if pc in self._hosts.get(pc.host, []):
+                self._hosts[pc.host].remove(pc)
+        self._wake(pc.host)
+
+    @asynccontextmanager
+    async def lease(self, host: str, timeout: float | None = None):
+        """Lease a channel slot on a pooled connection for the duration of the block."""
+        pc = await self.acquire(host, timeout)
+        try:
+            yield pc.conn
+        finally:
+            self.release(pc)
+
+    def discard(self, pc: _PooledConnection) -> None:
+        """Close a connection that stopped working. Its holders still release their leases."""
+        pc.broken = True
+        self._close(pc)
+
+    async def open_process(self, pc: _PooledConnection, timeout: float | None, *args,
+                           **kwargs) -> tuple[_PooledConnection, asyncssh.SSHClientProcess]:
+        """Open a channel (process) on a leased connection within timeout.
+
+        If that fails on a reused connection (likely half-dead), the connection is closed and the
+        channel is retried once on a fresh one. Returns the lease the process runs on, which then
+        replaces pc; if this raises, the caller still owns pc.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        def remaining() -> float | None:
+            return None if deadline is None else max(deadline - loop.time(), 0)
+
+        started = perf_counter()
+        try:
+            process = await asyncio.wait_for(pc.conn.create_process(*args, **kwargs), remaining())
+        except (asyncssh.Error, OSError, asyncio.TimeoutError) as e:
+            if not pc.opened_channels:
+                raise
+            logger.warning("Channel open failed on pooled connection to %s, reconnecting: %r", pc.host, e)
+            self.discard(pc)
+            if remaining() == 0:
+                raise
+            fresh = await self.acquire(pc.host, remaining(), new_connection=True)
+            try:
+                process = await asyncio.wait_for(fresh.conn.create_process(*args, **kwargs), remaining())
+            except BaseException:
+                self.release(fresh)
+                raise
+            self.release(pc)
+            pc = fresh
+        pc.opened_channels += 1
+        _metrics.observe("channel_open", perf_counter() - started)
+        return pc, process
+
+    @asynccontextmanager
+    async def lease_process(self, host: str, timeout: float | None, *args, **kwargs):
+        """Lease a slot and open a process on it (see open_process) for the duration of the block.
+        The timeout covers both waiting for the slot and opening the channel."""
+        started = perf_counter()
+        pc = await self.acquire(host, timeout)
+        _metrics.observe("pool_acquire", perf_counter() - started)
+        try:
+            left = None if timeout is None else max(timeout - (perf_counter() - started), 0)
+            pc, process = await self.open_process(pc, left, *args, **kwargs)
+            yield process
+        finally:
+            self.release(pc)
+
+    def has_capacity(self, host: str) -> bool:
+        """Whether acquire(host) can proceed without waiting."""
+        conns = [pc for pc in self._hosts.get(host, []) if pc.alive]
+        if any(pc.channels < POOL_MAX_CHANNELS_PER_CONNECTION for pc in conns):
+            return True
+        return len(conns) + self._connecting.get(host, 0) < POOL_MAX_CONNECTIONS_PER_HOST
+
+    def stats(self) -> dict:
+        return {host: {"connections": len(conns), "channels": sum(pc.channels for pc in conns)}
+                for host, conns in self._hosts.items() if conns}
+
+    def close_all(self) -> None:
+        for conns in self._hosts.values():
+            for pc in conns:
+                self._close(pc)
+        self._hosts.clear()
+
+
+_pool = _ConnectionPool()
+_compressed_pool = _ConnectionPool(compression_algs=SFTP_COMPRESSION_ALGS)  # used by transfers with compress=true
+
+
+class _ShellExited(Exception):
+    """The session's shell ended while a command was running (e.g. the command ran `exit`)."""
+
+
+async def _read_frame(reader, marker: bytes, sink: _OutputCapture, captures: tuple[_OutputCapture, ...],
+                      max_bytes: int) -> bytes:
+    """Read a stream into sink up to marker, returning the rest of the marker's line.
+
+    Data is searched a chunk at a time, holding back only enough to catch a marker split
+    across reads, so large outputs are never rescanned or held in memory.
+    """
+    pending = b""
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            sink.write(pending)
+            raise _ShellExited()
+        pending += chunk
+        idx = pending.find(marker)
+        if idx >= 0:
+            sink.write(pending[:idx])
+            rest = pending[idx + len(marker):]
+            while b"\n" not in rest:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    raise _ShellExited()
+                rest += chunk
+            return rest.split(b"\n", 1)[0]
+        keep = len(marker) - 1
+        sink.write(pending[:-keep])
+        pending = pending[-keep:]
+        if sum(c.total for c in captures) > max_bytes:
+            raise _OutputLimitReached()
+
+
+class _Session:
+    """A persistent session: one long-lived shell on a leased pooled connection.
+
+    Commands are written to the shell's stdin and framed by a per-session sentinel that
+    carries the exit code and working directory, so environment variables, functions and
+    activated virtualenvs persist between commands without a new channel per command.
+    """
+
+    def __init__(self, sid: str, host: str, pooled: _PooledConnection):
+        self.id = sid
+        self.host = host
+        self.pooled = pooled
+        self.cwd = "~"
+        self.created = self.last_used = time()
+        self.commands = 0
+        self.command_seconds = 0.0
+        self.shell_starts = 0
+        self._shell = None
+        self._lock = asyncio.Lock()
+        self._sentinel = f"___SSH_MCP_{uuid.uuid4().hex}___"
+
+    async def _start_shell(self, timeout: float) -> None:
+        started = perf_counter()
+        # A half-dead connection is replaced here, so the session may move to a new lease
+        self.pooled, self._shell = await _pool.open_process(self.pooled, timeout, encoding=None)
+        self.shell_starts += 1
+        # Restores cwd after a restart and swallows anything the login shell prints on startup
+        await self._run_framed("cd" if self.cwd == "~" else f"cd -- {shlex.quote(self.cwd)}",
+                               max(timeout - (perf_counter() - started), 0))
+
+    def _stop_shell(self) -> None:
+        if self._shell is not None:
+            try:
+                self._shell.close()
+            except Exception as e:
+                logger.warning("Failed to close shell for session %s: %s", self.id, e)
+            self._shell = None
+
+    async def _run_framed(self, command: str, timeout: float, max_output_bytes: int = OUTPUT_MAX_BYTES,
+                          spool: bool = False) -> dict:
+        shell = self._shell
+        shell.stdin.write((
+            # Plain eval is a special built-in: a syntax error in it would exit a dash/ash shell
+            f"command eval {shlex.quote(command)} </dev/null\n"
+            "__ssh_mcp_rc=$?\n"
+            f"printf '\\n%s %d %s\\n' {self._sentinel} \"$__ssh_mcp_rc\" \"$PWD\"\n"
+            f"printf '\\n%s %d\\n' {self._sentinel} \"$__ssh_mcp_rc\" >&2\n"
+        ).encode())
+        marker = f"\n{self._sentinel} ".encode()
+        stdout, stderr = _new_captures(spool)
+        captures = (stdout, stderr)
+        try:
+            trailer, _ = await asyncio.wait_for(
+                asyncio.gather(_read_frame(shell.stdout, marker, stdout, captures, max_output_bytes),
+                               _read_frame(shell.stderr, marker, stderr, captures, max_output_bytes)),
+                timeout=timeout,
+            )
+        except _ShellExited:
+            try:
+                await asyncio.wait_for(shell.wait_closed(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            self._stop_shell()
+            return {**_output_response(stdout, stderr), "exit_code": shell.exit_status, "shell_exited": True}
+        except _OutputLimitReached:
+            # The command is still writing; abandon this shell rather than drain it
+            self._stop_shell()
+            return {**_output_response(stdout, stderr, limit_reached=True), "exit_code": None, "shell_exited": True}
+        finally:
+            for capture in captures:
+                capture.close()
+            _metrics.count(self.host, "bytes_received", stdout.total + stderr.total)
+        exit_code, _, pwd = trailer.decode("utf-8", errors="replace").partition(" ")
+        self.cwd = pwd or self.cwd
+        return {**_output_response(stdout, stderr), "exit_code": int(exit_code)}
+
+    async def run(self, command: str, timeout: float, max_output_bytes: int = OUTPUT_MAX_BYTES, spool: bool = False) -> dict:
+        """Run a command in the session's shell, (re)starting the shell if needed."""
+        async with self._lock:
+            try:
+                if self._shell is None:
+                    await self._start_shell(timeout)
+                return await self._run_framed(command, timeout, max_output_bytes, spool)
+            except BaseException:
+                # The shell may still be busy with the command; start a fresh one next time
+                self._stop_shell()
+                raise
+
+    async def start(self, timeout: float = 30) -> None:
+        async with self._lock:
+            await self._start_shell(timeout)
+
+    @property
+    def busy(self) -> bool:
+        """Whether a command (or a shell start) is running in the session."""
+        return self._lock.locked()
+
+    def close(self) -> None:
+        self._stop_shell()
+        _pool.release(self.pooled)
+
+    def stats(self) -> dict:
+        now = time()
+        return {"session_id": self.id, "host": self.host, "cwd": self.cwd, "commands": self.commands,
+                "age_seconds": round(now - self.created, 1), "idle_seconds": round(now - self.last_used, 1),
+                "command_seconds": round(self.command_seconds, 3), "shell_starts": self.shell_starts}
+
+
+class _SessionManager:
+    """Session store kept in least-recently-used order.
+
+    Every session shares the same SESSION_TIMEOUT, so LRU order is also expiry order:
+    expired sessions are always at the front, which keeps reaping and eviction O(1) per
+    session. A background task reaps idle sessions; MAX_SESSIONS evicts the LRU session.
+    Sessions in the middle of a command are never reaped or evicted.
+    """
+
+    def __init__(self):
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+        # Why recently ended sessions went away, so callers get a useful error
+        self._ended: OrderedDict[str, str] = OrderedDict()
+        self._reaper: asyncio.Task | None = None
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._sessions
+
+    def _end(self, sid: str, reason: str) -> None:
+        self._sessions.pop(sid).close()
+        self._ended[sid] = reason
+        while len(self._ended) > MAX_SESSIONS:
+            self._ended.popitem(last=False)
+
+    def _ensure_reaper(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._reaper is None or self._reaper.done() or self._reaper.get_loop() is not loop:
+            self._reaper = loop.create_task(self._reap_forever())
+
+    async def _reap_forever(self) -> None:
+        while True:
+            await asyncio.sleep(SESSION_REAP_INTERVAL)
+            self.reap()
+
+    def reap(self) -> int:
+        """End sessions idle for longer than SESSION_TIMEOUT."""
+        cutoff = time() - SESSION_TIMEOUT
+        reaped = 0
+        for sid, session in list(self._sessions.items()):
+            if session.last_used > cutoff:
+                break
+            if session.busy:
+                continue
+            self._end(sid, "timed out")
+            reaped += 1
+        self.expired += reaped
+        return reaped
+
+    def _evict_lru(self, host: str | None = None) -> bool:
+        sid = next((sid for sid, s in self._sessions.items()
+                    if (host is None or s.host == host) and not s.busy), None)
+        if sid is None:
+            return False
+        logger.info("Evicting least-recently-used session %s", sid)
+        self._end(sid, "evicted (least recently used)")
+        self.evicted += 1
+        return True
+
+    async def open(self, host: str, timeout: float = 30) -> _Session:
+        """Start a session, waiting at most timeout for a pooled channel and the shell."""
+        self._ensure_reaper()
+        self.reap()
+        while len(self._sessions) >= MAX_SESSIONS:
+            if not self._evict_lru():
+                raise RuntimeError(f"All {MAX_SESSIONS} sessions are running commands. Close one or retry later.")
+        # Free a slot on this host rather than queueing behind sessions that may never close. Capacity
+        # held by commands and jobs frees up on its own, so only evict when sessions fill the host.
+        host_sessions = sum(1 for s in self._sessions.values() if s.host == host)
+        if (not _pool.has_capacity(host)
+                and host_sessions >= POOL_MAX_CONNECTIONS_PER_HOST * POOL_MAX_CHANNELS_PER_CONNECTION):
+            self._evict_lru(host)
+        started = perf_counter()
+        pooled = await _pool.acquire(host, timeout)
+        session = _Session(uuid.uuid4().hex[:12], host, pooled)
         try:
-            s["conn"].close()
+            await session.start(max(timeout - (perf_counter() - started), 0))
+        except BaseException:
+            session.close()
+            raise
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, sid: str) -> _Session | None:
+        """Look up a live session and mark it most recently used."""
+        self.reap()
+        session = self._sessions.get(sid)
+        if session is not None:
+            session.last_used = time()
+            self._sessions.move_to_end(sid)
+        return session
+
+    def missing_reason(self, sid: str) -> str:
+        return self._ended.get(sid, "not found")
+
+    def close(self, sid: str) -> bool:
+        if sid not in self._sessions:
+            return False
+        self._end(sid, "closed")
+        return True
+
+    def stats(self) -> dict:
+        return {"active": len(self._sessions), "max_sessions": MAX_SESSIONS, "expired": self.expired,
+                "evicted": self.evicted, "sessions": [s.stats() for s in reversed(self._sessions.values())]}
+
+    def close_all(self) -> None:
+        if self._reaper is not None and not self._reaper.done():
+            try:
+                self._reaper.cancel()
+            except RuntimeError:
+                pass
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+_sessions = _SessionManager()
+
+
+class _RingBuffer:
+    """The last `size` bytes of a stream, addressed by absolute byte offset."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.data = bytearray()
+        self.total = 0
+
+    @property
+    def start(self) -> int:
+        return self.total - len(self.data)
+
+    def write(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        self.data += chunk
+        if len(self.data) > self.size:
+            del self.data[:len(self.data) - self.size]
+
+    def read(self, offset: int, limit: int) -> tuple[bytes, int, int]:
+        """Return (data, offset actually read from, bytes dropped before it)."""
+        begin = max(offset, self.start)
+        rel = begin - self.start
+        return bytes(self.data[rel:rel + limit]), begin, begin - offset
+
+
+class _Job:
+    """A command running in the background on a pooled connection.
+
+    stdout and stderr are merged, in arrival order, into one ring buffer and a spool file.
+    """
+
+    def __init__(self, host: str, command: str, timeout: int | None):
+        self.id = uuid.uuid4().hex[:12]
+        self.host = host
+        self.command = command
+        self.timeout = timeout
+        self.status = "queued"
+        self.exit_code: int | None = None
+        self.error: str | None = None
+        self.created = time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.output = _RingBuffer(JOB_BUFFER_BYTES)
+        os.makedirs(SPOOL_DIR, mode=0o700, exist_ok=True)
+        self.spool_path = os.path.join(SPOOL_DIR, f"job-{self.id}.log")
+        self._spool = os.fdopen(os.open(self.spool_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb")
+        self.spooled = 0
+        self.spool_truncated = False
+        self.task: asyncio.Task | None = None
+
+    def _write(self, chunk: bytes) -> None:
+        self.output.write(chunk)
+        room = JOB_SPOOL_MAX_BYTES - self.spooled
+        if room > 0:
+            self._spool.write(chunk[:room])
+            self.spooled += min(len(chunk), room)
+        if len(chunk) > room:
+            self.spool_truncated = True
+
+    def discard(self) -> None:
+        """Close and delete the spool file."""
+        self._spool.close()
+        try:
+            os.remove(self.spool_path)
+        except FileNotFoundError:
+            pass
+
+    async def _pump(self, reader) -> None:
+        while chunk := await reader.read(65536):
+            self._write(chunk)
+
+    async def _run(self) -> None:
+        process = None
+        try:
+            async with _pool.lease_process(self.host, None, self.command, encoding=None) as process:
+                self.status = "running"
+                self.started = time()
+                process.stdin.write_eof()
+                await asyncio.wait_for(
+                    asyncio.gather(self._pump(process.stdout), self._pump(process.stderr), process.wait_closed()),
+                    timeout=self.timeout,
+                )
+                self.exit_code = process.exit_status
+                self.status = "succeeded" if self.exit_code == 0 else "failed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+        except asyncio.TimeoutError:
+            self.status, self.error = "failed", f"Job timed out after {self.timeout}s"
+            _metrics.count(self.host, "timeouts")
+        except asyncssh.Error as e:
+            self.status, self.error = "failed", f"SSH error: {e}"
+            _metrics.count(self.host, "errors")
         except Exception as e:
-            logger.warning("Failed to close session %s on shutdown: %s", sid, e)
-    _sessions.clear()
+            self.status, self.error = "failed", str(e)
+            _metrics.count(self.host, "errors")
+        finally:
+            if process is not None:
+                process.close()
+            self._spool.close()
+            self.finished = time()
+            _metrics.count(self.host, "bytes_received", self.output.total)
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    def stats(self) -> dict:
+        end = self.finished or time()
+        info = {"job_id": self.id, "host": self.host, "command": self.command, "status": self.status,
+                "exit_code": self.exit_code, "output_bytes": self.output.total, "spool_path": self.spool_path,
+                "runtime_seconds": round(end - self.started, 3) if self.started else 0.0}
+        if self.spool_truncated:
+            info["spool_truncated"] = True
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+_jobs: dict[str, _Job] = {}
+
+
+def _prune_jobs() -> None:
+    cutoff = time() - JOB_RETENTION
+    for jid in [jid for jid, job in _jobs.items() if job.done and job.finished < cutoff]:
+        _jobs.pop(jid).discard()
+
+
+def _cleanup_all():
+    """Close all sessions and pooled connections on shutdown."""
+    _sessions.close_all()
+    _pool.close_all()
+    _compressed_pool.close_all()
+    for job in _jobs.values():
+        job.discard()
+    _jobs.clear()
 
 
 atexit.register(_cleanup_all)
 
 
-@mcp.tool()
-async def ssh_execute(host: str, command: str, timeout: int = 30) -> dict:
-    """Run a one-shot command on a remote host. Connect, execute, return output, disconnect.
-    Uses ~/.ssh/config for host resolution and authentication."""
+async def _execute(host: str, command: str, timeout: int, max_output_bytes: int = OUTPUT_MAX_BYTES, spool: bool = False) -> dict:
+    started = perf_counter()
+    _metrics.count(host, "commands")
     try:
-        async with await _connect(host) as conn:
-            result = await asyncio.wait_for(conn.run(command), timeout=timeout)
-            return {"stdout": result.stdout.strip(), "stderr": result.stderr.strip(), "exit_code": result.exit_status}
+        # Waiting for a channel and opening it count against the caller's timeout
+        deadline = started + timeout
+        async with _pool.lease_process(host, timeout, command, encoding=None) as process:
+            opened = perf_counter()
+            process.stdin.write_eof()
+            stdout, stderr = _new_captures(spool)
+            captures = (stdout, stderr)
+            limit_reached = False
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(_pump(process.stdout, stdout, captures, max_output_bytes),
+                                   _pump(process.stderr, stderr, captures, max_output_bytes)),
+                    timeout=max(deadline - perf_counter(), 0),
+                )
+                await asyncio.wait_for(process.wait_closed(), timeout=max(deadline - perf_counter(), 0))
+            except _OutputLimitReached:
+                limit_reached = True
+            finally:
+                process.close()
+                for capture in captures:
+                    capture.close()
+                _metrics.count(host, "bytes_received", stdout.total + stderr.total)
+            _metrics.observe("command", perf_counter() - opened)
+            _metrics.observe("execute", perf_counter() - started)
+            return {**_output_response(stdout, stderr, limit_reached), "exit_code": process.exit_status}
+    except (_PoolBusy, _ConnectTimeout) as e:
+        _metrics.count(host, "timeouts")
+        return {"error": str(e)}
     except asyncssh.Error as e:
+        _metrics.count(host, "errors")
         return {"error": f"SSH error: {e}"}
     except asyncio.TimeoutError:
+        _metrics.count(host, "timeouts")
         return {"error": f"Command timed out after {timeout}s"}
     except Exception as e:
+        _metrics.count(host, "errors")
         return {"error": str(e)}
 
 
+def _group_by_output(results: dict[str, dict]) -> list[dict]:
+    """Collapse hosts with identical results into one entry each, largest group first."""
+    groups: dict[str, dict] = {}
+    for host, result in results.items():
+        digest = hashlib.sha256(repr(sorted(result.items())).encode()).hexdigest()[:16]
+        groups.setdefault(digest, {"hosts": [], "output_hash": digest, **result})["hosts"].append(host)
+    return sorted(groups.values(), key=lambda g: -len(g["hosts"]))
+
+
+def _transfer_path(local_path: str) -> str:
+    """Resolve a local transfer path inside TRANSFER_DIR, rejecting anything that escapes it."""
+    root = Path(TRANSFER_DIR).resolve()
+    target = (root / local_path).resolve()
+    if target != root and root not in target.parents:
+        raise ValueError("Invalid local_path: must stay inside SSH_MCP_TRANSFER_DIR")
+    root.mkdir(parents=True, exist_ok=True)
+    return str(target)
+
+
+def _inside_transfer_dir(path: str) -> bool:
+    root = Path(TRANSFER_DIR).resolve()
+    return root in Path(path).resolve().parents
+
+
+def _local_tree(root: str) -> tuple[str | None, dict[str, tuple[int, int]]]:
+    """Return ("file" | "dir" | None, {relative path: (size, mtime)}) for a local path."""
+    if os.path.isfile(root):
+        st = os.stat(root)
+        return "file", {"": (st.st_size, int(st.st_mtime))}
+    if not os.path.isdir(root):
+        return None, {}
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            # Symlinks could point outside TRANSFER_DIR, so they are not followed
+            if os.path.isfile(path) and not os.path.islink(path):
+                st = os.stat(path)
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = (st.st_size, int(st.st_mtime))
+    return "dir", files
+
+
+async def _remote_tree(sftp, root: str) -> tuple[str | None, dict[str, tuple[int, int]]]:
+    """Return ("file" | "dir" | None, {relative path: (size, mtime)}) for a remote path.
+    Directories are listed concurrently, so the requests are pipelined over the one SFTP channel."""
+    try:
+        attrs = await sftp.stat(root)
+    except asyncssh.SFTPNoSuchFile:
+        return None, {}
+    if attrs.type != asyncssh.FILEXFER_TYPE_DIRECTORY:
+        return "file", {"": (attrs.size or 0, int(attrs.mtime or 0))}
+    files = {}
+
+    async def walk(rel: str) -> None:
+        subdirs = []
+        for entry in await sftp.readdir(posixpath.join(root, rel)):
+            if entry.filename in (".", ".."):
+                continue
+            # Names come from the server; one with a separator could walk out of the destination
+            if "/" in entry.filename or os.sep in entry.filename or "\0" in entry.filename:
+                logger.warning("Skipping remote entry with an invalid name: %r", entry.filename)
+                continue
+            path = posixpath.join(rel, entry.filename)
+            if entry.attrs.type == asyncssh.FILEXFER_TYPE_DIRECTORY:
+                subdirs.append(path)
+            elif entry.attrs.type == asyncssh.FILEXFER_TYPE_REGULAR:
+                files[path] = (entry.attrs.size or 0, int(entry.attrs.mtime or 0))
+        await asyncio.gather(*(walk(d) for d in subdirs))
+
+    await walk("")
+    return "dir", files
+
+
+def _local_join(root: str, rel: str) -> str:
+    return os.path.join(root, *rel.split("/")) if rel else root
+
+
+def _remote_join(root: str, rel: str) -> str:
+    return posixpath.join(root, rel) if rel else root
+
+
+def _sha256_local(path: str) -> str | None:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+async def _remote_hashes(pool: _ConnectionPool, host: str, root: str, rels: list[str],
+                         timeout: float | None = None) -> dict[str, str]:
+    """SHA-256 of remote files via sha256sum, in batches. Files that cannot be hashed are left out."""
+    hashes = {}
+    async with pool.lease(host, timeout) as conn:
+        for i in range(0, len(rels), SFTP_HASH_BATCH):
+            paths = {_remote_join(root, rel): rel for rel in rels[i:i + SFTP_HASH_BATCH]}
+            result = await conn.run("sha256sum -- " + " ".join(shlex.quote(p) for p in paths), check=False)
+            for line in (result.stdout or "").splitlines():
+                digest, _, path = line.partition("  ")
+                if path in paths:
+                    hashes[paths[path]] = digest
+    return hashes
+
+
+async def _transfer(host: str, direction: str, local_path: str, remote_path: str, *, recursive: bool = True,
+                    sync: bool = False, checksum: bool = False, compress: bool = False, dry_run: bool = False,
+                    timeout: float = 30) -> dict:
+    """Copy a file or tree between the local machine and a host over SFTP.
+
+    With sync=True, files whose size and mtime (or, with checksum=True, size and SHA-256) already match
+    at the destination are skipped. Changed files are copied SFTP_PARALLEL_FILES at a time, each with up
+    to SFTP_MAX_REQUESTS block requests in flight, and keep their source mtime and permissions
+    (downloads drop setuid/setgid/sticky). The local side is confined to TRANSFER_DIR. timeout bounds
+    each wait for a pooled connection, not the copy itself.
+    """
+    pool = _compressed_pool if compress else _pool
+    try:
+        local_path = _transfer_path(local_path)
+    except ValueError as e:
+        return {"error": str(e)}
+    upload = direction == "upload"
+    source, dest = (local_path, remote_path) if upload else (remote_path, local_path)
+    started = time()
+    try:
+        async with pool.lease(host, timeout) as conn:
+            async with conn.start_sftp_client() as sftp:
+                local_kind, local_files = await asyncio.to_thread(_local_tree, local_path)
+                remote_kind, remote_files = await _remote_tree(sftp, remote_path)
+        src_kind, src_files, dst_kind, dst_files = (
+            (local_kind, local_files, remote_kind, remote_files) if upload
+            else (remote_kind, remote_files, local_kind, local_files))
+        if src_kind is None:
+            return {"error": f"No such file or directory: {source}"}
+        if src_kind == "dir" and not recursive:
+            return {"error": f"{source} is a directory. Pass recursive=true to copy it."}
+        if src_kind == "dir" and dst_kind == "file":
+            return {"error": f"Cannot copy directory {source} over file {dest}"}
+        if src_kind == "file" and dst_kind == "dir":
+            # Like cp and scp, a file copied onto a directory lands inside it
+            name = posixpath.basename(source) if not upload else os.path.basename(source)
+            dest = _remote_join(dest, name) if upload else _local_join(dest, name)
+            dst_files = {"": dst_files[name]} if name in dst_files else {}
+        local_root, remote_root = (source, dest) if upload else (dest, source)
+
+        skipped: set[str] = set()
+        if sync:
+            same_size = [rel for rel, (size, _) in src_files.items() if rel in dst_files and dst_files[rel][0] == size]
+            if checksum and same_size:
+                local_hashes = await asyncio.gather(
+                    *(asyncio.to_thread(_sha256_local, _local_join(local_root, rel)) for rel in same_size))
+                remote_hashes = await _remote_hashes(pool, host, remote_root, same_size, timeout)
+                skipped = {rel for rel, digest in zip(same_size, local_hashes)
+                           if digest is not None and remote_hashes.get(rel) == digest}
+            elif not checksum:
+                skipped = {rel for rel in same_size if dst_files[rel][1] == src_files[rel][1]}
+        pending = sorted(rel for rel in src_files if rel not in skipped)
+
+        result = {"direction": direction, "source": source, "destination": dest, "files_skipped": len(skipped)}
+        if dry_run:
+            return {**result, "dry_run": True, "files_to_transfer": len(pending),
+                    "bytes_to_transfer": sum(src_files[rel][0] for rel in pending), "paths": pending[:200]}
+
+        failed: dict[str, Exception] = {}
+        if pending:
+            async with pool.lease(host, timeout) as conn:
+                async with conn.start_sftp_client() as sftp:
+                    if upload:
+                        for parent in sorted({posixpath.dirname(_remote_join(remote_root, rel)) for rel in pending} - {""}):
+                            await sftp.makedirs(parent, exist_ok=True)
+                    else:
+                        # Only create directories for files that copy() will accept
+                        local_paths = (_local_join(local_root, rel) for rel in pending)
+                        for parent in sorted({os.path.dirname(local) for local in local_paths
+                                              if _inside_transfer_dir(local)} - {""}):
+                            os.makedirs(parent, exist_ok=True)
+                    limit = asyncio.Semaphore(SFTP_PARALLEL_FILES)
+
+                    async def copy(rel: str) -> None:
+                        local, remote = _local_join(local_root, rel), _remote_join(remote_root, rel)
+                        async with limit:
+                            if upload:
+                                await sftp.put(local, remote, preserve=True, max_requests=SFTP_MAX_REQUESTS)
+                                return
+                            if not _inside_transfer_dir(local):
+                                raise ValueError("Destination resolves outside SSH_MCP_TRANSFER_DIR")
+                            await sftp.get(remote, local, max_requests=SFTP_MAX_REQUESTS)
+                            # Keep times and plain permission bits, never setuid/setgid/sticky
+                            attrs = await sftp.stat(remote)
+                            os.utime(local, (attrs.atime or attrs.mtime, attrs.mtime))
+                            if attrs.permissions is not None:
+                                os.chmod(local, attrs.permissions & 0o777)
+
+                    outcomes = await asyncio.gather(*(copy(rel) for rel in pending), return_exceptions=True)
+            failed = {rel: outcome for rel, outcome in zip(pending, outcomes) if isinstance(outcome, Exception)}
+        copied = [rel for rel in pending if rel not in failed]
+        result.update(files_transferred=len(copied), bytes_transferred=sum(src_files[rel][0] for rel in copied),
+                      seconds=round(time() - started, 3), compressed=compress)
+        _metrics.count(host, "bytes_sent" if upload else "bytes_received", result["bytes_transferred"])
+        if failed:
+            result["failed"] = [{"path": rel or posixpath.basename(source), "error": str(e)} for rel, e in failed.items()]
+        return result
+    except (_PoolBusy, _ConnectTimeout) as e:
+        _metrics.count(host, "timeouts")
+        return {"error": str(e)}
+    except asyncssh.SFTPError as e:
+        _metrics.count(host, "errors")
+        return {"error": f"SFTP error: {e}"}
+    except asyncssh.Error as e:
+        _metrics.count(host, "errors")
+        return {"error": f"SSH error: {e}"}
+    except Exception as e:
+        _metrics.count(host, "errors")
+        return {"error": str(e)}
+
+
+@mcp.tool()
+async def ssh_execute(host: str, command: str, timeout: int = 30, max_output_bytes: int = OUTPUT_MAX_BYTES,
+                      spool: bool = False) -> dict:
+    """Run a one-shot command on a remote host over a pooled connection (reused across calls).
+    Uses ~/.ssh/config for host resolution and authentication. Large output is returned as its first and
+    last 16 KB plus total size and SHA-256; reading stops after max_output_bytes. Set spool=true to also
+    write the full output to local files (paths returned under "output")."""
+    return await _execute(host, command, timeout, max_output_bytes, spool)
+
+
 @mcp.tool()
-async def ssh_session_start(host: str) -> dict:
+async def ssh_execute_many(hosts: list[str], command: str, timeout: int = 30, max_concurrency: int = 10,
+                           group_identical: bool = False, ctx: Context | None = None) -> dict:
+    """Run the same command on many hosts concurrently (at most max_concurrency at once).
+    Returns per-host stdout/stderr/exit_code or error. Set group_identical=true to merge hosts
+    with identical results into groups, keeping the response small across a large fleet.
+    Progress is reported as each host completes."""
+    hosts = list(dict.fromkeys(hosts))
+    if not hosts:
+        return {"error": "No hosts given"}
+    if len(hosts) > MAX_FANOUT_HOSTS:
+        return {"error": f"Too many hosts ({len(hosts)}); the limit is {MAX_FANOUT_HOSTS}"}
+    if max_concurrency < 1:
+        return {"error": "max_concurrency must be at least 1"}
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(host: str) -> tuple[str, dict]:
+        async with semaphore:
+            return host, await _execute(host, command, timeout)
+
+    results: dict[str, dict] = {}
+    for done, future in enumerate(asyncio.as_completed([run_one(h) for h in hosts]), start=1):
+        host, result = await future
+        results[host] = result
+        if ctx is not None:
+            await ctx.report_progress(done, len(hosts), f"{host}: {'error' if 'error' in result else 'done'}")
+    results = {host: results[host] for host in hosts}
+    failed = sum(1 for r in results.values() if "error" in r or r.get("exit_code") != 0)
+    summary = {"hosts": len(hosts), "succeeded": len(hosts) - failed, "failed": failed}
+    if group_identical:
+        return {**summary, "groups": _group_by_output(results)}
+    return {**summary, "results": results}
+
+
+@mcp.tool()
+async def ssh_session_start(host: str, timeout: int = 30) -> dict:
     """Open a persistent SSH session to a host. Returns a session_id for subsequent commands.
-    Uses ~/.ssh/config for host resolution and authentication."""
-    await _cleanup_stale()
-    if len(_sessions) >= MAX_SESSIONS:
-        return {"error": f"Maximum number of sessions ({MAX_SESSIONS}) reached. Close an existing session first."}
+    Uses ~/.ssh/config for host resolution and authentication. Idle sessions expire after 30 minutes;
+    when the session limit is reached the least-recently-used session is closed. timeout bounds the
+    wait for a free pooled channel to the host and the shell start."""
     try:
-        conn = await _connect(host)
-        sid = uuid.uuid4().hex[:12]
-        _sessions[sid] = {"conn": conn, "host": host, "cwd": "~", "last_used": time()}
+        session = await _sessions.open(host, timeout)
+        sid = session.id
         return {"session_id": sid, "host": host, "message": f"Session opened. Use ssh_session_command('{sid}', '<command>') to run commands."}
+    except (_PoolBusy, _ConnectTimeout) as e:
+        return {"error": str(e)}
+    except asyncio.TimeoutError:
+        return {"error": f"Timed out after {timeout}s starting a shell on {host}"}
     except asyncssh.Error as e:
         return {"error": f"SSH error: {e}"}
     except Exception as e:
@@ -102,46 +1227,175 @@ async def ssh_session_start(host: str) -> dict:
 
 
 @mcp.tool()
-async def ssh_session_command(session_id: str, command: str, timeout: int = 30) -> dict:
-    """Run a command in an existing persistent SSH session (preserves working directory)."""
-    await _cleanup_stale()
-    if session_id not in _sessions:
-        return {"error": f"Session '{session_id}' not found. It may have timed out."}
-    s = _sessions[session_id]
-    s["last_used"] = time()
+async def ssh_session_command(session_id: str, command: str, timeout: int = 30,
+                              max_output_bytes: int = OUTPUT_MAX_BYTES, spool: bool = False) -> dict:
+    """Run a command in an existing persistent SSH session. The session keeps one shell open, so the
+    working directory, environment variables, shell functions and activated virtualenvs persist.
+    Output is bounded and optionally spooled as for ssh_execute; hitting max_output_bytes restarts the shell."""
+    s = _sessions.get(session_id)
+    if s is None:
+        return {"error": f"Session '{session_id}' {_sessions.missing_reason(session_id)}."}
+    started = perf_counter()
+    _metrics.count(s.host, "commands")
     try:
-        cwd = _validate_path(s["cwd"])
-        wrapped = f"cd {cwd} && {{ {command}; }}; echo '___CWD___'; pwd"
-        result = await asyncio.wait_for(s["conn"].run(wrapped), timeout=timeout)
-        stdout = result.stdout
-        if "___CWD___\n" in stdout:
-            parts = stdout.rsplit("___CWD___\n", 1)
-            stdout = parts[0]
-            new_cwd = parts[1].strip()
-            s["cwd"] = _validate_path(new_cwd)
-        return {"stdout": stdout.strip(), "stderr": result.stderr.strip(), "exit_code": result.exit_status, "cwd": s["cwd"]}
+        result = await s.run(command, timeout, max_output_bytes, spool)
+        _metrics.observe("session_command", perf_counter() - started)
+        response = {k: v for k, v in result.items() if k != "shell_exited"} | {"cwd": s.cwd}
+        if session_id not in _sessions:
+            response["message"] = f"The session was {_sessions.missing_reason(session_id)} while the command was running."
+        elif result.get("output", {}).get("limit_reached"):
+            response["message"] = ("Output reached max_output_bytes, so the session shell was stopped. A new shell will be "
+                                   "started for the next command (environment reset, cwd kept).")
+        elif result.get("shell_exited"):
+            response["message"] = ("The session shell exited; a new shell will be started for the next command "
+                                   "(environment reset, cwd kept).")
+        return response
     except asyncio.TimeoutError:
-        return {"error": f"Command timed out after {timeout}s"}
-    except ValueError as e:
-        return {"error": str(e)}
+        _metrics.count(s.host, "timeouts")
+        return {"error": f"Command timed out after {timeout}s. The session shell was restarted (environment reset, cwd kept)."}
     except asyncssh.Error as e:
+        _metrics.count(s.host, "errors")
         return {"error": f"SSH error: {e}"}
     except Exception as e:
+        _metrics.count(s.host, "errors")
         return {"error": str(e)}
+    finally:
+        s.commands += 1
+        s.command_seconds += perf_counter() - started
+        s.last_used = time()
 
 
 @mcp.tool()
 async def ssh_session_close(session_id: str) -> dict:
     """Close a persistent SSH session."""
-    if session_id not in _sessions:
-        return {"error": f"Session '{session_id}' not found."}
-    try:
-        _sessions[session_id]["conn"].close()
-    except Exception as e:
-        logger.warning("Error closing session %s: %s", session_id, e)
-    del _sessions[session_id]
+    if not _sessions.close(session_id):
+        return {"error": f"Session '{session_id}' {_sessions.missing_reason(session_id)}."}
     return {"status": "closed"}
 
 
+@mcp.tool()
+async def ssh_session_list() -> dict:
+    """List open sessions, most recently used first, with per-session stats (commands run,
+    time spent in commands, age, idle time) and totals for expired and evicted sessions."""
+    _sessions.reap()
+    return _sessions.stats()
+
+
+@mcp.tool()
+async def ssh_job_start(host: str, command: str, timeout: int | None = None) -> dict:
+    """Start a long-running command (build, backup, upgrade) in the background and return a job_id at once.
+    Output is captured to a ring buffer and a local spool file; poll with ssh_job_status and ssh_job_tail.
+    timeout (seconds) is optional — by default the job runs until it finishes or is cancelled."""
+    _prune_jobs()
+    running = sum(1 for job in _jobs.values() if not job.done)
+    if running >= MAX_RUNNING_JOBS:
+        return {"error": f"Maximum number of running jobs ({MAX_RUNNING_JOBS}) reached. Cancel or wait for a job first."}
+    try:
+        job = _Job(host, command, timeout)
+    except OSError as e:
+        return {"error": f"Cannot create spool file: {e}"}
+    job.task = asyncio.get_running_loop().create_task(job._run())
+    _jobs[job.id] = job
+    return {"job_id": job.id, "host": host, "status": job.status,
+            "message": f"Job started. Use ssh_job_tail('{job.id}', offset) to read output and ssh_job_status('{job.id}') to poll."}
+
+
+@mcp.tool()
+async def ssh_job_status(job_id: str | None = None) -> dict:
+    """Get the status, exit code and output size of a background job, or of all jobs when job_id is omitted."""
+    _prune_jobs()
+    if job_id is None:
+        return {"jobs": [job.stats() for job in _jobs.values()]}
+    job = _jobs.get(job_id)
+    if job is None:
+        return {"error": f"Job '{job_id}' not found."}
+    return job.stats()
+
+
+@mcp.tool()
+async def ssh_job_tail(job_id: str, offset: int = 0, max_bytes: int = JOB_TAIL_MAX_BYTES) -> dict:
+    """Read a background job's output from a byte offset (stdout and stderr merged). Pass the returned
+    next_offset to continue. Use a negative offset to read the last N bytes. Output older than the
+    in-memory buffer is reported as dropped_bytes but remains in the job's spool file (first 256 MB)."""
+    job = _jobs.get(job_id)
+    if job is None:
+        return {"error": f"Job '{job_id}' not found."}
+    if offset < 0:
+        offset = max(job.output.total + offset, 0)
+    data, begin, dropped = job.output.read(offset, min(max(max_bytes, 0), JOB_TAIL_MAX_BYTES))
+    result = {"output": data.decode("utf-8", errors="replace"), "offset": begin, "next_offset": begin + len(data),
+              "total_bytes": job.output.total, "status": job.status, "exit_code": job.exit_code}
+    if dropped:
+        result["dropped_bytes"] = dropped
+    return result
+
+
+@mcp.tool()
+async def ssh_job_cancel(job_id: str) -> dict:
+    """Cancel a running background job. Its channel is closed, which ends the remote command."""
+    job = _jobs.get(job_id)
+    if job is None:
+        return {"error": f"Job '{job_id}' not found."}
+    if job.done:
+        return {"job_id": job_id, "status": job.status, "message": "Job already finished."}
+    job.task.cancel()
+    try:
+        await job.task
+    except asyncio.CancelledError:
+        pass
+    return {"job_id": job_id, "status": job.status}
+
+
+@mcp.tool()
+async def ssh_upload(host: str, local_path: str, remote_path: str, recursive: bool = False,
+                     compress: bool = False, timeout: int = 30) -> dict:
+    """Upload a local file, or a directory with recursive=true, to a remote host over SFTP.
+    local_path must be inside SSH_MCP_TRANSFER_DIR (relative paths are resolved against it).
+    Large files are sent as many parallel block requests and several files are copied at once, over a
+    pooled connection. Set compress=true for compressible data over slow links. Modification times and
+    permissions are preserved. A file uploaded onto an existing remote directory is placed inside it.
+    timeout bounds the wait for a free pooled connection to the host, not the copy itself."""
+    return await _transfer(host, "upload", local_path, remote_path, recursive=recursive, compress=compress,
+                           timeout=timeout)
+
+
+@mcp.tool()
+async def ssh_download(host: str, remote_path: str, local_path: str, recursive: bool = False,
+                       compress: bool = False, timeout: int = 30) -> dict:
+    """Download a remote file, or a directory with recursive=true, from a host over SFTP.
+    local_path must be inside SSH_MCP_TRANSFER_DIR (relative paths are resolved against it).
+    Same parallelism and compression as ssh_upload; modification times and permissions are kept,
+    except setuid/setgid/sticky bits. timeout bounds the wait for a free pooled connection, as in ssh_upload."""
+    return await _transfer(host, "download", local_path, remote_path, recursive=recursive, compress=compress,
+                           timeout=timeout)
+
+
+@mcp.tool()
+async def ssh_sync(host: str, local_path: str, remote_path: str, direction: str = "upload",
+                   checksum: bool = False, compress: bool = False, dry_run: bool = False, timeout: int = 30) -> dict:
+    """Sync a file or directory tree between the local machine and a host over SFTP (direction "upload"
+    or "download"). local_path must be inside SSH_MCP_TRANSFER_DIR. Destination files with the same size and modification time are skipped; set
+    checksum=true to compare SHA-256 instead (needs sha256sum on the host). Files are never deleted.
+    Use dry_run=true to see what would be copied. timeout bounds the wait for a free pooled connection."""
+    if direction not in ("upload", "download"):
+        return {"error": f"Invalid direction '{direction}'. Use 'upload' or 'download'."}
+    return await _transfer(host, direction, local_path, remote_path, sync=True, checksum=checksum,
+                           compress=compress, dry_run=dry_run, timeout=timeout)
+
+
+@mcp.tool()
+async def ssh_get_metrics(format: str = "json") -> dict:
+    """Get timing and traffic metrics since the server started. Per-phase latency histograms show where time
+    goes: dns_tcp, kex and auth (connect), pool_acquire, channel_open and command (ssh_execute), and
+    session_command. Also per-host counters (connections opened/reused, commands, timeouts, errors, bytes)
+    and gauges for open sessions, connections, channels and running jobs.
+    Set format="prometheus" for the Prometheus text exposition format."""
+    if format == "prometheus":
+        return {"content_type": "text/plain; version=0.0.4", "metrics": _metrics.prometheus()}
+    if format != "json":
+        return {"error": f"Invalid format '{format}'. Use 'json' or 'prometheus'."}
+    return _metrics.snapshot()
+
+
 if __name__ == "__main__":
     mcp.run()
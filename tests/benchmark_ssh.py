@@ -0,0 +1,219 @@
+"""Benchmarks for the SSH MCP server against a local asyncssh stand-in (see ssh_standin.py).
+
+Every measurement calls the tools through FastMCP (mcp.call_tool), so argument validation and
+result serialization are included. Latencies are reported as p50/p99 in milliseconds.
+
+    uv run --project ssh-mcp python tests/benchmark_ssh.py
+    uv run --project ssh-mcp python tests/benchmark_ssh.py --json after.json --compare before.json
+
+The stand-in runs on localhost, so the numbers show ssh-mcp's own overhead (connection setup, channel
+and session handling, output capture) rather than network latency. Compare runs on the same machine.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from ssh_standin import HOST_ALIAS, SSHStandin  # noqa: E402
+
+MIB = 1024 * 1024
+
+
+def _load_server_module(module_name: str = "ssh_server_benchmark_module"):
+    sys.modules.pop(module_name, None)
+    server_path = Path(__file__).resolve().parents[1] / "ssh-mcp" / "server.py"
+    spec = importlib.util.spec_from_file_location(module_name, server_path)
+    module = importlib.util.module_from_spec(spec)
+    assert spec.loader is not None
+    spec.loader.exec_module(module)
+    return module
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _summary(name: str, latencies: list[float], **extra) -> dict:
+    return {
+        "name": name,
+        "n": len(latencies),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        **extra,
+    }
+
+
+class _Bench:
+    def __init__(self, server):
+        self.server = server
+
+    async def call(self, tool: str, **arguments) -> dict:
+        content = await self.server.mcp.call_tool(tool, arguments)
+        result = json.loads(content[0].text)
+        if "error" in result:
+            raise RuntimeError(f"{tool} failed: {result['error']}")
+        return result
+
+    async def timed(self, tool: str, **arguments) -> tuple[float, dict]:
+        started = perf_counter()
+        result = await self.call(tool, **arguments)
+        return perf_counter() - started, result
+
+    async def connect(self, iterations: int) -> list[dict]:
+        """A command on an empty pool pays for the TCP connect, key exchange and authentication."""
+        latencies = []
+        for _ in range(iterations):
+            self.server._pool.close_all()
+            latencies.append((await self.timed("ssh_execute", host=HOST_ALIAS, command="true"))[0])
+        return [_summary("connect + execute (cold pool)", latencies)]
+
+    async def execute(self, iterations: int, concurrency: int) -> list[dict]:
+        await self.call("ssh_execute", host=HOST_ALIAS, command="true")
+        warm = [(await self.timed("ssh_execute", host=HOST_ALIAS, command="echo ok"))[0] for _ in range(iterations)]
+
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one() -> float:
+            async with limit:
+                return (await self.timed("ssh_execute", host=HOST_ALIAS, command="echo ok"))[0]
+
+        count = iterations * concurrency
+        started = perf_counter()
+        concurrent = await asyncio.gather(*(one() for _ in range(count)))
+        elapsed = perf_counter() - started
+        return [
+            _summary("execute (warm pool, sequential)", warm, ops_per_sec=round(len(warm) / sum(warm), 1)),
+            _summary(f"execute (concurrency {concurrency})", list(concurrent), ops_per_sec=round(count / elapsed, 1)),
+        ]
+
+    async def session_latency(self, iterations: int) -> list[dict]:
+        start, session = await self.timed("ssh_session_start", host=HOST_ALIAS)
+        sid = session["session_id"]
+        try:
+            latencies = [(await self.timed("ssh_session_command", session_id=sid, command="echo ok"))[0]
+                         for _ in range(iterations)]
+        finally:
+            await self.call("ssh_session_close", session_id=sid)
+        return [_summary("session command", latencies, session_start_ms=round(start * 1000, 3))]
+
+    async def session_scaling(self, iterations: int, levels: list[int]) -> list[dict]:
+        """Open N sessions at once, then run iterations commands in each, all sessions concurrently."""
+        capacity = self.server.POOL_MAX_CONNECTIONS_PER_HOST * self.server.POOL_MAX_CHANNELS_PER_CONNECTION
+        results = []
+        for level in [n for n in levels if n <= capacity]:
+            starts = await asyncio.gather(*(self.timed("ssh_session_start", host=HOST_ALIAS) for _ in range(level)))
+            sids = [session["session_id"] for _, session in starts]
+
+            async def drive(sid: str) -> list[float]:
+                return [(await self.timed("ssh_session_command", session_id=sid, command="echo ok"))[0]
+                        for _ in range(iterations)]
+
+            try:
+                started = perf_counter()
+                per_session = await asyncio.gather(*(drive(sid) for sid in sids))
+                elapsed = perf_counter() - started
+            finally:
+                for sid in sids:
+                    await self.call("ssh_session_close", session_id=sid)
+            latencies = [latency for session in per_session for latency in session]
+            results.append(_summary(
+                f"{level} concurrent sessions", latencies, ops_per_sec=round(len(latencies) / elapsed, 1),
+                session_start_p99_ms=round(_percentile([t for t, _ in starts], 99) * 1000, 3),
+            ))
+        return results
+
+    async def large_output(self, iterations: int, sizes_mib: list[int]) -> list[dict]:
+        results = []
+        sid = (await self.call("ssh_session_start", host=HOST_ALIAS))["session_id"]
+        try:
+            for size in sizes_mib:
+                command = f"head -c {size * MIB} /dev/zero"
+                for tool, arguments in (("ssh_execute", {"host": HOST_ALIAS}), ("ssh_session_command", {"session_id": sid})):
+                    latencies = []
+                    for _ in range(max(iterations // 10, 3)):
+                        latency, result = await self.timed(tool, command=command, **arguments)
+                        assert result["output"]["stdout"]["bytes"] == size * MIB
+                        latencies.append(latency)
+                    results.append(_summary(f"{tool} {size} MiB output", latencies,
+                                            mib_per_sec=round(size / _percentile(latencies, 50), 1)))
+        finally:
+            await self.call("ssh_session_close", session_id=sid)
+        return results
+
+
+async def run_benchmarks(iterations: int = 200, concurrency: int = 16, levels: list[int] | None = None,
+                         sizes_mib: list[int] | None = None) -> list[dict]:
+    """Start a stand-in with a throwaway HOME, run every benchmark and return one summary per measurement."""
+    levels = levels or [1, 4, 16, 32]
+    sizes_mib = sizes_mib or [1, 16, 48]
+    with tempfile.TemporaryDirectory(prefix="ssh-mcp-bench-") as scratch:
+        home, remote = Path(scratch) / "home", Path(scratch) / "remote"
+        remote.mkdir()
+        saved = {name: os.environ.get(name) for name in ("HOME", "SSH_AUTH_SOCK")}
+        os.environ["HOME"] = str(home)
+        os.environ.pop("SSH_AUTH_SOCK", None)
+        server = _load_server_module()
+        try:
+            async with SSHStandin(remote) as standin:
+                standin.write_ssh_home(home)
+                bench = _Bench(server)
+                results = []
+                results += await bench.connect(max(iterations // 10, 5))
+                results += await bench.execute(iterations, concurrency)
+                results += await bench.session_latency(iterations)
+                results += await bench.session_scaling(max(iterations // 10, 5), levels)
+                results += await bench.large_output(iterations, sizes_mib)
+                server._cleanup_all()
+                return results
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def _format(results: list[dict], baseline: dict[str, dict] | None = None) -> str:
+    lines = [f"{'benchmark':<40} {'n':>5} {'p50 ms':>10} {'p99 ms':>10}  extra"]
+    for r in results:
+        extra = ", ".join(f"{k}={v}" for k, v in r.items() if k not in ("name", "n", "p50_ms", "p99_ms", "mean_ms"))
+        line = f"{r['name']:<40} {r['n']:>5} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f}  {extra}"
+        before = (baseline or {}).get(r["name"])
+        if before:
+            line += (f"  [p50 {(r['p50_ms'] / before['p50_ms'] - 1) * 100:+.0f}%,"
+                     f" p99 {(r['p99_ms'] / before['p99_ms'] - 1) * 100:+.0f}%]")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200, help="commands per latency measurement")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel ssh_execute calls")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument("--compare", type=Path, help="show changes against results saved with --json")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args.iterations, args.concurrency))
+    baseline = None
+    if args.compare:
+        baseline = {r["name"]: r for r in json.loads(args.compare.read_text())}
+    print(_format(results, baseline))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
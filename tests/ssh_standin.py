@@ -0,0 +1,108 @@
+"""Local asyncssh stand-in for a remote SSH host, used by the ssh-mcp tests and benchmarks.
+
+The server listens on 127.0.0.1 with throwaway keys. It runs commands and shells with the local
+/bin/sh in a scratch directory, which is also the chrooted SFTP root. write_ssh_home() writes a
+HOME directory (.ssh/config, known_hosts, client key) that points a host alias at the server,
+so ssh-mcp connects through its normal ~/.ssh/config path.
+"""
+
+import asyncio
+from pathlib import Path
+
+import asyncssh
+
+HOST_ALIAS = "standin"
+
+
+class _Server(asyncssh.SSHServer):
+    def __init__(self, standin: "SSHStandin"):
+        self._standin = standin
+
+    def connection_made(self, conn: asyncssh.SSHServerConnection) -> None:
+        self._standin.connections += 1
+
+
+class SSHStandin:
+    """A local SSH server. Use as `async with SSHStandin(root) as standin:`."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.host_key = asyncssh.generate_private_key("ssh-ed25519")
+        self.client_key = asyncssh.generate_private_key("ssh-ed25519")
+        self.port = 0
+        self.connections = 0
+        self._listener: asyncssh.SSHAcceptor | None = None
+
+    async def _handle(self, process: asyncssh.SSHServerProcess) -> None:
+        """Run the exec request (or a shell) locally, streaming stdin and output both ways."""
+        args = ["/bin/sh"] + (["-c", process.command] if process.command is not None else [])
+        proc = await asyncio.create_subprocess_exec(
+            *args, cwd=self.root, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        async def pump_out(reader, writer) -> None:
+            while chunk := await reader.read(65536):
+                try:
+                    writer.write(chunk)
+                    await writer.drain()
+                except (asyncssh.Error, OSError):
+                    # The client closed the channel; stop the command like sshd would
+                    proc.kill()
+                    return
+
+        async def pump_in() -> None:
+            try:
+                while chunk := await process.stdin.read(65536):
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+            except (asyncssh.Error, OSError):
+                pass
+            proc.stdin.close()
+
+        stdin = asyncio.ensure_future(pump_in())
+        try:
+            await asyncio.gather(pump_out(proc.stdout, process.stdout), pump_out(proc.stderr, process.stderr))
+            code = await proc.wait()
+        finally:
+            stdin.cancel()
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        try:
+            process.exit(code)
+        except (asyncssh.Error, OSError):
+            pass
+
+    async def __aenter__(self) -> "SSHStandin":
+        self._listener = await asyncssh.listen(
+            "127.0.0.1", 0, server_factory=lambda: _Server(self), server_host_keys=[self.host_key],
+            authorized_client_keys=asyncssh.import_authorized_keys(self.client_key.export_public_key().decode()),
+            process_factory=self._handle, encoding=None,
+            sftp_factory=lambda chan: asyncssh.SFTPServer(chan, chroot=str(self.root).encode()),
+        )
+        self.port = self._listener.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._listener.close()
+        await self._listener.wait_closed()
+
+    def write_ssh_home(self, home: Path) -> None:
+        """Write .ssh/config, known_hosts and the client key so HOST_ALIAS resolves to this server."""
+        ssh_dir = home / ".ssh"
+        ssh_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+        key_path = ssh_dir / "id_ed25519"
+        self.client_key.write_private_key(key_path)
+        key_path.chmod(0o600)
+        known_hosts = ssh_dir / "known_hosts"
+        known_hosts.write_text(f"[127.0.0.1]:{self.port} {self.host_key.export_public_key().decode()}")
+        (ssh_dir / "config").write_text(
+            f"Host {HOST_ALIAS}\n"
+            f"  HostName 127.0.0.1\n"
+            f"  Port {self.port}\n"
+            f"  User tester\n"
+            f"  IdentityFile {key_path}\n"
+            f"  IdentitiesOnly yes\n"
+            f"  UserKnownHostsFile {known_hosts}\n"
+        )
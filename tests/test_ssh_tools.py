@@ -0,0 +1,1001 @@
+"""Tests for SSH MCP server tools, using fake connections and a local SSH stand-in (ssh_standin.py)."""
+
+import asyncio
+import hashlib
+import importlib.util
+import os
+import shlex
+import signal
+import sys
+from pathlib import Path
+
+import asyncssh
+import pytest
+from ssh_standin import HOST_ALIAS, SSHStandin
+
+
+def _load_server_module(module_name: str = "ssh_server_tools_test_module"):
+    sys.modules.pop(module_name, None)
+    server_path = Path(__file__).resolve().parents[1] / "ssh-mcp" / "server.py"
+    spec = importlib.util.spec_from_file_location(module_name, server_path)
+    module = importlib.util.module_from_spec(spec)
+    assert spec.loader is not None
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeStream:
+    """Wrapper over a local subprocess pipe, shaped like asyncssh's binary-mode reader/writer."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def read(self, n: int = -1) -> bytes:
+        return await self._stream.read(n)
+
+    def write(self, data: bytes) -> None:
+        self._stream.write(data)
+
+    def write_eof(self) -> None:
+        self._stream.close()
+
+
+class FakeProcess:
+    """A local /bin/sh standing in for a remote asyncssh.SSHClientProcess (command or shell)."""
+
+    def __init__(self, proc):
+        self._proc = proc
+        self.stdin = FakeStream(proc.stdin)
+        self.stdout = FakeStream(proc.stdout)
+        self.stderr = FakeStream(proc.stderr)
+
+    @property
+    def exit_status(self) -> int | None:
+        return self._proc.returncode
+
+    async def wait_closed(self) -> None:
+        # Drain to EOF first: a full, paused pipe would keep wait() from ever completing
+        for stream in (self._proc.stdout, self._proc.stderr):
+            try:
+                await stream.read()
+            except RuntimeError:
+                pass
+        await self._proc.wait()
+
+    def close(self) -> None:
+        self._proc.stdin.close()
+        # Like a closed channel, take down anything the shell started too
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class FakeConnection:
+    """Stands in for asyncssh.SSHClientConnection, running commands with the local /bin/sh."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.closed = False
+        self.stalled = False  # channel opens hang, like a half-dead connection
+        self.failing = False  # channel opens are refused
+        self.commands: list[str] = []
+        self.processes: list[FakeProcess] = []
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+    async def create_process(self, command: str | None = None, **kwargs) -> FakeProcess:
+        if self.stalled:
+            await asyncio.sleep(3600)
+        if self.failing:
+            raise asyncssh.ChannelOpenError(asyncssh.OPEN_CONNECT_FAILED, "Channel open failed")
+        if command is not None:
+            self.commands.append(command)
+        args = ["/bin/sh"] + (["-c", command] if command is not None else [])
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        self.processes.append(FakeProcess(proc))
+        return self.processes[-1]
+
+
+def _run(server, coro):
+    """Run a test coroutine, then close sessions and reap fake shells before the loop ends."""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            server._sessions.close_all()
+            for conn in server.opened:
+                for process in conn.processes:
+                    process.close()
+                    await process.wait_closed()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch):
+    module = _load_server_module()
+    opened: list[FakeConnection] = []
+
+    async def fake_connect(host: str, **options) -> FakeConnection:
+        if host.startswith("down"):
+            raise OSError(f"Connect call failed for {host}")
+        conn = FakeConnection(host)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(module, "_connect", fake_connect)
+    module.opened = opened
+    yield module
+    module._cleanup_all()
+
+
+class TestConnectionPool:
+    """Tests for pooled, reused SSH connections."""
+
+    def test_sequential_commands_reuse_one_connection(self, server):
+        async def run():
+            for _ in range(5):
+                assert (await server.ssh_execute("web1", "echo up"))["stdout"] == "up"
+
+        _run(server, run())
+        assert len(server.opened) == 1
+        assert len(server.opened[0].commands) == 5
+
+    def test_concurrency_is_capped_per_host(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "POOL_MAX_CONNECTIONS_PER_HOST", 2)
+        monkeypatch.setattr(server, "POOL_MAX_CHANNELS_PER_CONNECTION", 3)
+
+        async def run():
+            return await asyncio.gather(*[server.ssh_execute("web1", f"sleep 0.01; echo {i}") for i in range(20)])
+
+        results = _run(server, run())
+        assert all(r["exit_code"] == 0 for r in results)
+        assert len(server.opened) == 2
+
+    def test_dead_and_idle_connections_are_replaced(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def run():
+            await server.ssh_execute("web1", "true")
+            server.opened[0].closed = True
+            await server.ssh_execute("web1", "true")
+            monkeypatch.setattr(server, "POOL_IDLE_TIMEOUT", -1)
+            await server.ssh_execute("web1", "true")
+
+        _run(server, run())
+        assert len(server.opened) == 3
+        assert server.opened[1].closed
+
+    def test_idle_connections_to_other_hosts_are_closed(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def run():
+            await server.ssh_execute("a", "true")
+            monkeypatch.setattr(server, "POOL_IDLE_TIMEOUT", -1)
+            await server.ssh_execute("b", "true")
+            return server._pool.stats()
+
+        stats = _run(server, run())
+        assert [conn.closed for conn in server.opened] == [True, False]
+        assert list(stats) == ["b"]
+
+    def test_background_reaper_closes_idle_connections(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "POOL_REAP_INTERVAL", 0.05)
+
+        async def run():
+            await server.ssh_execute("a", "true")
+            monkeypatch.setattr(server, "POOL_IDLE_TIMEOUT", -1)
+            await asyncio.sleep(0.2)
+
+        _run(server, run())
+        assert server.opened[0].closed
+
+    def test_waiting_for_a_busy_host_counts_against_timeout(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "POOL_MAX_CONNECTIONS_PER_HOST", 1)
+        monkeypatch.setattr(server, "POOL_MAX_CHANNELS_PER_CONNECTION", 1)
+
+        async def run():
+            job_id = (await server.ssh_job_start("web1", "sleep 3"))["job_id"]
+            await asyncio.sleep(0.1)
+            started = asyncio.get_running_loop().time()
+            busy = await server.ssh_execute("web1", "echo hi", timeout=0.5)
+            elapsed = asyncio.get_running_loop().time() - started
+            await server.ssh_job_cancel(job_id)
+            return busy, elapsed, await server.ssh_execute("web1", "echo hi", timeout=1)
+
+        busy, elapsed, after = _run(server, run())
+        assert "waiting for a free channel" in busy["error"]
+        assert elapsed < 1
+        assert after["stdout"] == "hi"
+
+    def test_sessions_and_transfers_give_up_on_a_busy_host(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "POOL_MAX_CONNECTIONS_PER_HOST", 1)
+        monkeypatch.setattr(server, "POOL_MAX_CHANNELS_PER_CONNECTION", 1)
+
+        async def run():
+            job_id = (await server.ssh_job_start("web1", "sleep 3"))["job_id"]
+            await asyncio.sleep(0.1)
+            started = asyncio.get_running_loop().time()
+            results = await asyncio.gather(
+                server.ssh_session_start("web1", timeout=0.3),
+                server.ssh_upload("web1", "a.txt", "inbox", timeout=0.3),
+                server.ssh_download("web1", "inbox/a.txt", "a.txt", timeout=0.3),
+                server.ssh_sync("web1", "tree", "mirror", timeout=0.3),
+            )
+            elapsed = asyncio.get_running_loop().time() - started
+            await server.ssh_job_cancel(job_id)
+            return results, elapsed
+
+        results, elapsed = _run(server, run())
+        assert all("waiting for a free channel" in result["error"] for result in results)
+        assert elapsed < 1
+        assert server._metrics.snapshot()["hosts"]["web1"]["timeouts"] == 3
+
+    def test_stalled_channel_open_respects_timeout(self, server):
+        async def run():
+            await server.ssh_execute("web1", "true")
+            server.opened[0].stalled = True
+            started = asyncio.get_running_loop().time()
+            stalled = await server.ssh_execute("web1", "true", timeout=0.3)
+            elapsed = asyncio.get_running_loop().time() - started
+            return stalled, elapsed, await server.ssh_execute("web1", "echo back")
+
+        stalled, elapsed, after = _run(server, run())
+        assert "timed out" in stalled["error"]
+        assert elapsed < 1
+        assert server.opened[0].closed
+        assert after["stdout"] == "back"
+
+    def test_failed_channel_open_retries_on_fresh_connection(self, server):
+        async def run():
+            await server.ssh_execute("web1", "true")
+            server.opened[0].failing = True
+            return await server.ssh_execute("web1", "echo retried")
+
+        assert _run(server, run())["stdout"] == "retried"
+        assert len(server.opened) == 2
+        assert server.opened[0].closed
+
+    def test_session_restart_moves_to_fresh_connection(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, "exit 1")
+            server.opened[0].failing = True
+            result = await server.ssh_session_command(sid, "echo restarted")
+            return result, server._sessions.get(sid).pooled.conn, server._pool.stats()
+
+        result, conn, stats = _run(server, run())
+        assert result["stdout"] == "restarted"
+        assert conn is server.opened[1]
+        assert stats == {"web1": {"connections": 1, "channels": 1}}
+
+    def test_sessions_share_pooled_connections(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_execute("web1", "true")
+            assert server._pool.stats()["web1"] == {"connections": 1, "channels": 1}
+            await server.ssh_session_close(sid)
+            assert server._pool.stats()["web1"]["channels"] == 0
+
+        _run(server, run())
+        assert len(server.opened) == 1
+        assert not server.opened[0].closed
+
+
+class TestExecuteMany:
+    """Tests for running one command across many hosts."""
+
+    def test_per_host_results_in_input_order(self, server):
+        hosts = [f"web{i}" for i in range(12)] + ["down1", "web0"]
+        result = _run(server, server.ssh_execute_many(hosts, "echo up", max_concurrency=4))
+        assert list(result["results"]) == hosts[:-1]
+        assert result["results"]["web3"]["stdout"] == "up"
+        assert "Connect call failed" in result["results"]["down1"]["error"]
+        assert (result["hosts"], result["succeeded"], result["failed"]) == (13, 12, 1)
+
+    def test_concurrency_limit_is_respected(self, server, monkeypatch: pytest.MonkeyPatch):
+        running = peak = 0
+        real_execute = server._execute
+
+        async def tracking_execute(host, command, timeout):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            try:
+                return await real_execute(host, command, timeout)
+            finally:
+                running -= 1
+
+        monkeypatch.setattr(server, "_execute", tracking_execute)
+        _run(server, server.ssh_execute_many([f"h{i}" for i in range(30)], "id", max_concurrency=5))
+        assert peak == 5
+
+    def test_group_identical_outputs(self, server):
+        hosts = [f"web{i}" for i in range(10)] + ["down1", "down2"]
+        result = _run(server, server.ssh_execute_many(hosts, "echo same", group_identical=True))
+        assert "results" not in result
+        assert [len(g["hosts"]) for g in result["groups"]] == [10, 1, 1]
+        assert result["groups"][0]["stdout"] == "same"
+
+    def test_rejects_invalid_arguments(self, server):
+        assert "error" in _run(server, server.ssh_execute_many([], "id"))
+        assert "error" in _run(server, server.ssh_execute_many(["web1"], "id", max_concurrency=0))
+
+
+class TestSessionManager:
+    """Tests for session expiry, LRU eviction and stats."""
+
+    def test_lru_session_is_evicted_at_capacity(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "MAX_SESSIONS", 3)
+
+        async def run():
+            sids = [(await server.ssh_session_start(f"web{i}"))["session_id"] for i in range(3)]
+            await server.ssh_session_command(sids[0], "ls")
+            newest = (await server.ssh_session_start("web9"))["session_id"]
+            assert sids[0] in server._sessions and newest in server._sessions
+            return await server.ssh_session_command(sids[1], "ls")
+
+        evicted = _run(server, run())
+        assert "evicted" in evicted["error"]
+        assert server._sessions.evicted == 1
+        assert server.opened[1].is_closed() is False
+
+    def test_session_on_full_host_evicts_that_hosts_lru(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "POOL_MAX_CONNECTIONS_PER_HOST", 1)
+        monkeypatch.setattr(server, "POOL_MAX_CHANNELS_PER_CONNECTION", 2)
+
+        async def run():
+            other = (await server.ssh_session_start("db1"))["session_id"]
+            first = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_start("web1")
+            await asyncio.wait_for(server.ssh_session_start("web1"), timeout=1)
+            assert other in server._sessions
+            assert first not in server._sessions
+
+        _run(server, run())
+
+    def test_idle_sessions_are_reaped(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            monkeypatch.setattr(server, "SESSION_TIMEOUT", -1)
+            return sid, await server.ssh_session_command(sid, "ls")
+
+        sid, result = _run(server, run())
+        assert result["error"] == f"Session '{sid}' timed out."
+        assert server._pool.stats()["web1"]["channels"] == 0
+
+    def test_busy_sessions_are_not_evicted_or_reaped(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "MAX_SESSIONS", 2)
+
+        async def run():
+            busy, idle = [(await server.ssh_session_start("web1"))["session_id"] for _ in range(2)]
+            command = asyncio.ensure_future(server.ssh_session_command(busy, "sleep 0.3; echo finished"))
+            await asyncio.sleep(0.1)
+            newest = (await server.ssh_session_start("web2"))["session_id"]
+            assert busy in server._sessions and idle not in server._sessions
+            monkeypatch.setattr(server, "SESSION_TIMEOUT", -1)
+            assert server._sessions.reap() == 1
+            assert busy in server._sessions and newest not in server._sessions
+            return await command
+
+        result = _run(server, run())
+        assert (result["stdout"], result["exit_code"]) == ("finished", 0)
+
+    def test_session_limit_with_every_session_busy(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "MAX_SESSIONS", 1)
+
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            command = asyncio.ensure_future(server.ssh_session_command(sid, "sleep 0.3"))
+            await asyncio.sleep(0.1)
+            refused = await server.ssh_session_start("web2")
+            await command
+            return refused
+
+        assert "running commands" in _run(server, run())["error"]
+
+    def test_commands_holding_a_host_do_not_evict_its_sessions(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "POOL_MAX_CONNECTIONS_PER_HOST", 1)
+        monkeypatch.setattr(server, "POOL_MAX_CHANNELS_PER_CONNECTION", 2)
+
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            command = asyncio.ensure_future(server.ssh_execute("web1", "sleep 0.3"))
+            await asyncio.sleep(0.1)
+            newest = await server.ssh_session_start("web1", timeout=2)
+            await command
+            assert sid in server._sessions and newest["session_id"] in server._sessions
+
+        _run(server, run())
+        assert server._sessions.evicted == 0
+
+    def test_closing_a_session_mid_command_says_so(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            command = asyncio.ensure_future(server.ssh_session_command(sid, "sleep 1"))
+            await asyncio.sleep(0.1)
+            await server.ssh_session_close(sid)
+            return await command
+
+        assert _run(server, run())["message"] == "The session was closed while the command was running."
+
+    def test_session_list_reports_stats_most_recent_first(self, server):
+        async def run():
+            a = (await server.ssh_session_start("web1"))["session_id"]
+            b = (await server.ssh_session_start("web2"))["session_id"]
+            await server.ssh_session_command(a, "ls")
+            await server.ssh_session_command(a, "pwd")
+            return a, b, await server.ssh_session_list()
+
+        a, b, listing = _run(server, run())
+        assert listing["active"] == 2
+        assert [s["session_id"] for s in listing["sessions"]] == [a, b]
+        assert listing["sessions"][0]["commands"] == 2
+
+
+class TestPersistentShell:
+    """Tests for the long-lived shell behind each session."""
+
+    def test_shell_state_persists_between_commands(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, "cd /tmp && export GREETING=hi && greet() { echo \"$GREETING $1\"; }")
+            return await server.ssh_session_command(sid, "greet there; pwd")
+
+        assert _run(server, run()) == {"stdout": "hi there\n/tmp", "stderr": "", "exit_code": 0, "cwd": "/tmp"}
+
+    def test_exit_code_stderr_and_quoting(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            return await server.ssh_session_command(sid, "printf '%s' \"it's\"; echo oops >&2; exit_status=3; (exit $exit_status)")
+
+        result = _run(server, run())
+        assert (result["stdout"], result["stderr"], result["exit_code"]) == ("it's", "oops", 3)
+
+    @pytest.mark.parametrize("typo", ['echo "unterminated', "for i in 1 2; do echo $i"])
+    def test_syntax_error_keeps_shell_state(self, server, typo):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, "export X=kept")
+            failed = await server.ssh_session_command(sid, typo)
+            return failed, await server.ssh_session_command(sid, 'echo "$X"'), server._sessions.get(sid).shell_starts
+
+        failed, after, shell_starts = _run(server, run())
+        assert failed["exit_code"] != 0
+        assert "message" not in failed
+        assert after["stdout"] == "kept"
+        assert shell_starts == 1
+
+    def test_commands_do_not_read_the_control_stream(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            first = await server.ssh_session_command(sid, "cat")
+            return first, await server.ssh_session_command(sid, "echo still-alive")
+
+        first, second = _run(server, run())
+        assert first["exit_code"] == 0
+        assert second["stdout"] == "still-alive"
+
+    def test_timeout_restarts_shell_and_keeps_cwd(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, "cd /tmp; export KEPT=yes")
+            timed_out = await server.ssh_session_command(sid, "sleep 1", timeout=0.2)
+            after = await server.ssh_session_command(sid, "echo \"[$KEPT]\"; pwd")
+            return timed_out, after, server._sessions.stats()["sessions"][0]["shell_starts"]
+
+        timed_out, after, shell_starts = _run(server, run())
+        assert "restarted" in timed_out["error"]
+        assert after["stdout"] == "[]\n/tmp"
+        assert shell_starts == 2
+
+    def test_restart_keeps_cwd_with_special_characters(self, server, tmp_path: Path):
+        awkward = tmp_path / "a b" / "it's $HOME"
+        awkward.mkdir(parents=True)
+
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, f"cd -- {shlex.quote(str(awkward))}")
+            await server.ssh_session_command(sid, "sleep 1", timeout=0.2)
+            return await server.ssh_session_command(sid, "pwd")
+
+        after = _run(server, run())
+        assert after["stdout"] == str(awkward)
+        assert after["cwd"] == str(awkward)
+
+    def test_restart_does_not_run_shell_syntax_in_cwd(self, server, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        hostile = tmp_path / "x; touch semicolon" / "$(touch substitution)" / "`touch backtick`"
+        hostile.mkdir(parents=True)
+        # Fake shells start here, so anything injected would touch files under tmp_path
+        monkeypatch.chdir(tmp_path)
+
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, f"cd -- {shlex.quote(str(hostile))}")
+            await server.ssh_session_command(sid, "exit 0")
+            restored = await server.ssh_session_command(sid, "pwd")
+            # A cwd that was never a real directory must not be run either
+            server._sessions.get(sid).cwd = f"{tmp_path}'; touch quote; '"
+            await server.ssh_session_command(sid, "exit 0")
+            return restored, await server.ssh_session_command(sid, "pwd")
+
+        restored, missing = _run(server, run())
+        assert restored["stdout"] == str(hostile)
+        assert missing["exit_code"] == 0
+        assert not [p.name for p in tmp_path.rglob("*") if p.is_file()]
+
+    def test_exit_reports_code_and_next_command_gets_new_shell(self, server):
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            exited = await server.ssh_session_command(sid, "exit 4")
+            return exited, await server.ssh_session_command(sid, "echo back")
+
+        exited, after = _run(server, run())
+        assert exited["exit_code"] == 4
+        assert "message" in exited
+        assert after["stdout"] == "back"
+
+
+class TestOutputCapture:
+    """Tests for bounded head/tail output capture."""
+
+    def test_small_output_is_returned_whole(self, server):
+        result = _run(server, server.ssh_execute("web1", "echo out; echo err >&2"))
+        assert result == {"stdout": "out", "stderr": "err", "exit_code": 0}
+
+    def test_large_output_keeps_head_tail_size_and_hash(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "OUTPUT_HEAD_BYTES", 100)
+        monkeypatch.setattr(server, "OUTPUT_TAIL_BYTES", 100)
+        result = _run(server, server.ssh_execute("web1", "seq 1 100000"))
+        full = "".join(f"{i}\n" for i in range(1, 100001)).encode()
+        assert result["stdout"].startswith("1\n2\n3\n")
+        assert result["stdout"].endswith("99999\n100000")
+        assert f"[{len(full) - 200} bytes omitted]" in result["stdout"]
+        assert result["output"]["stdout"] == {"bytes": len(full), "sha256": hashlib.sha256(full).hexdigest(), "truncated": True}
+        assert result["output"]["limit_reached"] is False
+
+    def test_reading_stops_at_byte_limit(self, server):
+        result = _run(server, server.ssh_execute("web1", "yes", max_output_bytes=200_000, timeout=5))
+        assert result["output"]["limit_reached"] is True
+        assert result["output"]["stdout"]["bytes"] < 200_000 + 65536
+
+    def test_spool_writes_full_output(self, server, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        monkeypatch.setattr(server, "SPOOL_DIR", str(tmp_path / "spool"))
+        monkeypatch.setattr(server, "OUTPUT_TAIL_BYTES", 10)
+        result = _run(server, server.ssh_execute("web1", "seq 1 50000", spool=True))
+        spooled = Path(result["output"]["stdout"]["spool_path"]).read_bytes()
+        assert spooled == "".join(f"{i}\n" for i in range(1, 50001)).encode()
+        assert result["output"]["stdout"]["sha256"] == hashlib.sha256(spooled).hexdigest()
+
+    def test_session_output_is_bounded_and_limit_restarts_shell(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "OUTPUT_HEAD_BYTES", 50)
+        monkeypatch.setattr(server, "OUTPUT_TAIL_BYTES", 50)
+
+        async def run():
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            large = await server.ssh_session_command(sid, "seq 1 100000")
+            limited = await server.ssh_session_command(sid, "yes", max_output_bytes=100_000, timeout=5)
+            return large, limited, await server.ssh_session_command(sid, "echo ok")
+
+        large, limited, after = _run(server, run())
+        assert large["exit_code"] == 0
+        assert large["stdout"].endswith("100000")
+        assert large["output"]["stdout"]["truncated"] is True
+        assert limited["output"]["limit_reached"] is True
+        assert "environment reset" in limited["message"]
+        assert after["stdout"] == "ok"
+
+
+class TestBackgroundJobs:
+    """Tests for background jobs with buffered, spooled output."""
+
+    @pytest.fixture(autouse=True)
+    def spool_dir(self, server, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        monkeypatch.setattr(server, "SPOOL_DIR", str(tmp_path / "spool"))
+
+    @staticmethod
+    async def _wait(server, job_id: str) -> dict:
+        while (status := await server.ssh_job_status(job_id))["status"] in ("queued", "running"):
+            await asyncio.sleep(0.01)
+        return status
+
+    def test_job_runs_in_background_and_output_can_be_tailed(self, server):
+        async def run():
+            started = await server.ssh_job_start("web1", "echo one; sleep 0.2; echo two >&2; exit 3")
+            assert started["status"] == "queued"
+            first = await server.ssh_job_tail(started["job_id"])
+            status = await self._wait(server, started["job_id"])
+            rest = await server.ssh_job_tail(started["job_id"], offset=first["next_offset"])
+            return first, status, rest
+
+        first, status, rest = _run(server, run())
+        assert (status["status"], status["exit_code"], status["output_bytes"]) == ("failed", 3, 8)
+        assert first["output"] + rest["output"] == "one\ntwo\n"
+        assert rest["next_offset"] == 8
+        assert Path(status["spool_path"]).read_bytes() == b"one\ntwo\n"
+
+    def test_ring_buffer_drops_old_output_but_spool_keeps_it(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "JOB_BUFFER_BYTES", 1000)
+
+        async def run():
+            job_id = (await server.ssh_job_start("web1", "seq 1 10000"))["job_id"]
+            status = await self._wait(server, job_id)
+            return status, await server.ssh_job_tail(job_id, offset=0), await server.ssh_job_tail(job_id, offset=-6)
+
+        status, head, last = _run(server, run())
+        assert head["dropped_bytes"] == status["output_bytes"] - 1000
+        assert last["output"] == "10000\n"
+        assert len(Path(status["spool_path"]).read_bytes()) == status["output_bytes"]
+
+    def test_spool_is_capped(self, server, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(server, "JOB_SPOOL_MAX_BYTES", 100)
+
+        async def run():
+            return await self._wait(server, (await server.ssh_job_start("web1", "seq 1 1000"))["job_id"])
+
+        status = _run(server, run())
+        assert status["status"] == "succeeded"
+        assert status["spool_truncated"] is True
+        assert Path(status["spool_path"]).read_bytes() == b"".join(b"%d\n" % i for i in range(1, 1001))[:100]
+
+    def test_pruned_jobs_remove_their_spool_files(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def run():
+            status = await self._wait(server, (await server.ssh_job_start("web1", "echo hi"))["job_id"])
+            assert Path(status["spool_path"]).exists()
+            monkeypatch.setattr(server, "JOB_RETENTION", -1)
+            return status, await server.ssh_job_status()
+
+        status, listing = _run(server, run())
+        assert listing["jobs"] == []
+        assert not Path(status["spool_path"]).exists()
+
+    def test_cancel_and_timeout(self, server):
+        async def run():
+            slow = (await server.ssh_job_start("web1", "sleep 5"))["job_id"]
+            timed = (await server.ssh_job_start("web1", "sleep 5", timeout=0.1))["job_id"]
+            await asyncio.sleep(0.05)
+            cancelled = await server.ssh_job_cancel(slow)
+            return cancelled, await self._wait(server, timed), await server.ssh_job_status()
+
+        cancelled, timed, listing = _run(server, run())
+        assert cancelled["status"] == "cancelled"
+        assert "timed out" in timed["error"]
+        assert len(listing["jobs"]) == 2
+
+    def test_many_jobs_run_concurrently(self, server):
+        async def run():
+            ids = [(await server.ssh_job_start(f"web{i % 4}", "sleep 0.3; echo done"))["job_id"] for i in range(12)]
+            started = asyncio.get_running_loop().time()
+            statuses = [await self._wait(server, jid) for jid in ids]
+            return asyncio.get_running_loop().time() - started, statuses
+
+        elapsed, statuses = _run(server, run())
+        assert all(s["status"] == "succeeded" for s in statuses)
+        assert elapsed < 2
+
+    def test_unknown_job(self, server):
+        assert "not found" in _run(server, server.ssh_job_tail("nope"))["error"]
+
+
+def _run_with_standin(server, remote_root: Path, home: Path, test):
+    """Run test(standin) with HOST_ALIAS pointing at a local SSH server rooted at remote_root."""
+
+    async def main():
+        async with SSHStandin(remote_root) as standin:
+            standin.write_ssh_home(home)
+            try:
+                return await test(standin)
+            finally:
+                server._pool.close_all()
+                server._compressed_pool.close_all()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def real_server(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    """The server module connecting for real, with HOME (and so ~/.ssh/config) under tmp_path."""
+    home = tmp_path / "home"
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("SSH_MCP_TRANSFER_DIR", str(tmp_path / "local"))
+    monkeypatch.delenv("SSH_AUTH_SOCK", raising=False)
+    module = _load_server_module()
+    module.home = home
+    yield module
+    module._cleanup_all()
+
+
+class TestAgainstStandin:
+    """End-to-end checks over real asyncssh connections, resolved through a test ~/.ssh/config."""
+
+    @pytest.fixture(autouse=True)
+    def remote_root(self, tmp_path: Path):
+        (tmp_path / "remote").mkdir()
+
+    def test_execute_session_and_job(self, real_server, tmp_path: Path):
+        async def test(standin):
+            executed = await real_server.ssh_execute(HOST_ALIAS, "echo hello; echo oops >&2; exit 4")
+            sid = (await real_server.ssh_session_start(HOST_ALIAS))["session_id"]
+            await real_server.ssh_session_command(sid, "mkdir -p work && cd work && export GREETING=hi")
+            in_session = await real_server.ssh_session_command(sid, 'echo "$GREETING from $(basename "$PWD")"')
+            job_id = (await real_server.ssh_job_start(HOST_ALIAS, "seq 1 3"))["job_id"]
+            while (await real_server.ssh_job_status(job_id))["status"] in ("queued", "running"):
+                await asyncio.sleep(0.01)
+            return executed, in_session, await real_server.ssh_job_tail(job_id), standin.connections
+
+        executed, in_session, tail, connections = _run_with_standin(real_server, tmp_path / "remote",
+                                                                    real_server.home, test)
+        assert executed == {"stdout": "hello", "stderr": "oops", "exit_code": 4}
+        assert in_session["stdout"] == "hi from work"
+        assert tail["output"] == "1\n2\n3\n"
+        assert connections == 1
+
+    def test_benchmark_suite_runs(self):
+        from benchmark_ssh import run_benchmarks
+
+        results = asyncio.run(run_benchmarks(iterations=3, concurrency=2, levels=[1, 2], sizes_mib=[1]))
+        names = [r["name"] for r in results]
+        assert "connect + execute (cold pool)" in names
+        assert "2 concurrent sessions" in names
+        assert "ssh_session_command 1 MiB output" in names
+        assert all(0 < r["p50_ms"] <= r["p99_ms"] for r in results)
+
+
+class TestFileTransfer:
+    """Tests for SFTP upload, download and sync against a local asyncssh server."""
+
+    @pytest.fixture
+    def dirs(self, tmp_path: Path) -> tuple[Path, Path]:
+        local, remote = tmp_path / "local", tmp_path / "remote"
+        (local / "tree" / "sub" / "deeper").mkdir(parents=True)
+        remote.mkdir()
+        (local / "tree" / "a.txt").write_text("alpha\n")
+        (local / "tree" / "sub" / "b.txt").write_text("bravo\n")
+        (local / "tree" / "sub" / "deeper" / "big.bin").write_bytes(os.urandom(3 * 1024 * 1024 + 7))
+        return local, remote
+
+    def test_upload_and_download_single_file(self, real_server, dirs):
+        local, remote = dirs
+        (remote / "inbox").mkdir()
+        os.utime(local / "tree" / "a.txt", (1_600_000_000, 1_600_000_000))
+
+        async def test(_):
+            up = await real_server.ssh_upload(HOST_ALIAS, str(local / "tree" / "a.txt"), "inbox")
+            down = await real_server.ssh_download(HOST_ALIAS, "inbox/a.txt", str(local / "copy.txt"))
+            return up, down
+
+        up, down = _run_with_standin(real_server, remote, real_server.home, test)
+        assert (up["destination"], up["files_transferred"], up["bytes_transferred"]) == ("inbox/a.txt", 1, 6)
+        assert down["files_transferred"] == 1
+        assert (remote / "inbox" / "a.txt").read_text() == "alpha\n"
+        assert (local / "copy.txt").read_text() == "alpha\n"
+        assert int((remote / "inbox" / "a.txt").stat().st_mtime) == 1_600_000_000
+
+    def test_recursive_round_trip(self, real_server, dirs):
+        local, remote = dirs
+
+        async def test(_):
+            up = await real_server.ssh_upload(HOST_ALIAS, str(local / "tree"), "dest/tree", recursive=True)
+            down = await real_server.ssh_download(HOST_ALIAS, "dest/tree", str(local / "back"), recursive=True)
+            return up, down
+
+        up, down = _run_with_standin(real_server, remote, real_server.home, test)
+        assert up["files_transferred"] == down["files_transferred"] == 3
+        assert up["bytes_transferred"] == 6 + 6 + 3 * 1024 * 1024 + 7
+        for rel in ("a.txt", "sub/b.txt", "sub/deeper/big.bin"):
+            original = (local / "tree" / rel).read_bytes()
+            assert (remote / "dest" / "tree" / rel).read_bytes() == original
+            assert (local / "back" / rel).read_bytes() == original
+
+    def test_sync_skips_unchanged_files(self, real_server, dirs):
+        local, remote = dirs
+        edited = local / "tree" / "sub" / "b.txt"
+
+        async def test(_):
+            first = await real_server.ssh_sync(HOST_ALIAS, str(local / "tree"), "mirror")
+            again = await real_server.ssh_sync(HOST_ALIAS, str(local / "tree"), "mirror")
+            # Same size and mtime, different content: only a checksum comparison notices
+            stat = edited.stat()
+            edited.write_text("BRAVO\n")
+            os.utime(edited, (stat.st_atime, stat.st_mtime))
+            by_mtime = await real_server.ssh_sync(HOST_ALIAS, str(local / "tree"), "mirror")
+            planned = await real_server.ssh_sync(HOST_ALIAS, str(local / "tree"), "mirror", checksum=True, dry_run=True)
+            by_hash = await real_server.ssh_sync(HOST_ALIAS, str(local / "tree"), "mirror", checksum=True)
+            pulled = await real_server.ssh_sync(HOST_ALIAS, str(local / "pulled"), "mirror", direction="download")
+            return first, again, by_mtime, planned, by_hash, pulled
+
+        first, again, by_mtime, planned, by_hash, pulled = _run_with_standin(real_server, remote, real_server.home, test)
+        assert (first["files_transferred"], first["files_skipped"]) == (3, 0)
+        assert (again["files_transferred"], again["files_skipped"]) == (0, 3)
+        assert by_mtime["files_transferred"] == 0
+        assert (planned["files_to_transfer"], planned["paths"]) == (1, ["sub/b.txt"])
+        assert (by_hash["files_transferred"], by_hash["files_skipped"]) == (1, 2)
+        assert (remote / "mirror" / "sub" / "b.txt").read_text() == "BRAVO\n"
+        assert pulled["files_transferred"] == 3
+        assert (local / "pulled" / "sub" / "b.txt").read_text() == "BRAVO\n"
+
+    def test_compress_uses_a_separate_compressed_connection(self, real_server, dirs):
+        local, remote = dirs
+        (local / "log.txt").write_text("same line\n" * 100_000)
+
+        connect_options = []
+        connect = real_server._connect
+
+        async def spy(host: str, **options):
+            connect_options.append(options)
+            return await connect(host, **options)
+
+        real_server._connect = spy
+
+        async def test(_):
+            return await real_server.ssh_upload(HOST_ALIAS, str(local / "log.txt"), "log.txt", compress=True)
+
+        result = _run_with_standin(real_server, remote, real_server.home, test)
+        assert result["compressed"] is True
+        assert connect_options == [{"compression_algs": real_server.SFTP_COMPRESSION_ALGS}]
+        assert (remote / "log.txt").read_text() == (local / "log.txt").read_text()
+
+    def test_local_paths_are_confined_to_transfer_dir(self, real_server, dirs, tmp_path: Path):
+        local, remote = dirs
+        (remote / "evil.sh").write_text("echo owned\n")
+        (remote / "evil.sh").chmod(0o4755)
+        secret = tmp_path / "home" / "secret"
+        secret.parent.mkdir(parents=True, exist_ok=True)
+        secret.write_text("key")
+        (local / "link").symlink_to(secret)
+
+        async def test(_):
+            return (await real_server.ssh_download(HOST_ALIAS, "evil.sh", str(tmp_path / "home" / ".bashrc")),
+                    await real_server.ssh_upload(HOST_ALIAS, "../home/secret", "stolen"),
+                    await real_server.ssh_upload(HOST_ALIAS, "link", "stolen"),
+                    await real_server.ssh_upload(HOST_ALIAS, ".", "everything", recursive=True),
+                    await real_server.ssh_download(HOST_ALIAS, "evil.sh", "evil.sh"))
+
+        outside, traversal, link, tree, relative = _run_with_standin(real_server, remote, real_server.home, test)
+        assert "SSH_MCP_TRANSFER_DIR" in outside["error"] and "SSH_MCP_TRANSFER_DIR" in traversal["error"]
+        assert "SSH_MCP_TRANSFER_DIR" in link["error"]
+        assert not (tmp_path / "home" / ".bashrc").exists()
+        assert not (remote / "stolen").exists()
+        assert tree["files_transferred"] == 3
+        assert not (remote / "everything" / "link").exists()
+        assert relative["destination"] == str(local / "evil.sh")
+        assert (local / "evil.sh").stat().st_mode & 0o7777 == 0o755
+
+    def test_download_ignores_hostile_remote_names(self, real_server, dirs, tmp_path: Path,
+                                                   monkeypatch: pytest.MonkeyPatch):
+        local, remote = dirs
+        (remote / "tree").mkdir()
+        (remote / "tree" / "ok.txt").write_text("fine\n")
+        readdir = asyncssh.SFTPClient.readdir
+
+        async def hostile_readdir(self, path):
+            entries = await readdir(self, path)
+            attrs = asyncssh.SFTPAttrs(type=asyncssh.FILEXFER_TYPE_REGULAR, size=1, mtime=0)
+            return entries + [asyncssh.SFTPName("../../escape/f", "", attrs)]
+
+        monkeypatch.setattr(asyncssh.SFTPClient, "readdir", hostile_readdir)
+
+        async def test(_):
+            return await real_server.ssh_download(HOST_ALIAS, "tree", "copy", recursive=True)
+
+        result = _run_with_standin(real_server, remote, real_server.home, test)
+        assert (result["files_transferred"], result.get("failed")) == (1, None)
+        assert (local / "copy" / "ok.txt").read_text() == "fine\n"
+        assert not (tmp_path / "escape").exists()
+        assert not (local / "escape").exists()
+
+    def test_download_never_creates_directories_outside_transfer_dir(self, real_server, dirs, tmp_path: Path,
+                                                                     monkeypatch: pytest.MonkeyPatch):
+        local, remote = dirs
+        (remote / "ok.txt").write_text("fine\n")
+
+        async def hostile_tree(sftp, root):
+            return "dir", {"ok.txt": (5, 0), "../../escape/f": (1, 0)}
+
+        monkeypatch.setattr(real_server, "_remote_tree", hostile_tree)
+
+        async def test(_):
+            return await real_server.ssh_download(HOST_ALIAS, ".", "copy", recursive=True)
+
+        result = _run_with_standin(real_server, remote, real_server.home, test)
+        assert result["files_transferred"] == 1
+        assert "SSH_MCP_TRANSFER_DIR" in result["failed"][0]["error"]
+        assert not (tmp_path / "escape").exists()
+
+    def test_errors(self, real_server, dirs):
+        local, remote = dirs
+
+        async def test(_):
+            return (await real_server.ssh_upload(HOST_ALIAS, str(local / "missing"), "x"),
+                    await real_server.ssh_upload(HOST_ALIAS, str(local / "tree"), "x"),
+                    await real_server.ssh_download(HOST_ALIAS, "missing.txt", str(local / "x")),
+                    await real_server.ssh_sync(HOST_ALIAS, str(local / "tree"), "x", direction="sideways"))
+
+        missing, not_recursive, missing_remote, bad_direction = _run_with_standin(real_server, remote, real_server.home, test)
+        assert "No such file" in missing["error"]
+        assert "recursive=true" in not_recursive["error"]
+        assert "No such file" in missing_remote["error"]
+        assert "Invalid direction" in bad_direction["error"]
+
+
+class TestMetrics:
+    """Tests for latency histograms, per-host counters, gauges and the Prometheus output."""
+
+    def test_histogram_quantiles_interpolate_within_buckets(self, server):
+        histogram = server._Histogram()
+        for ms in range(1, 101):
+            histogram.observe(ms / 1000)
+        assert 0.04 <= histogram.quantile(0.5) <= 0.06
+        assert 0.09 <= histogram.quantile(0.99) <= 0.1
+        assert histogram.snapshot()["max_ms"] == 100.0
+
+    def test_execute_and_session_counters(self, server):
+        async def run():
+            for _ in range(3):
+                await server.ssh_execute("web1", "printf 12345")
+            await server.ssh_execute("web1", "sleep 1", timeout=0.1)
+            await server.ssh_execute("down1", "true")
+            sid = (await server.ssh_session_start("web1"))["session_id"]
+            await server.ssh_session_command(sid, "printf abc")
+            return await server.ssh_get_metrics()
+
+        metrics = _run(server, run())
+        web1 = metrics["hosts"]["web1"]
+        assert (web1["connections_opened"], web1["connections_reused"]) == (1, 4)
+        assert (web1["commands"], web1["timeouts"], web1["errors"]) == (5, 1, 0)
+        assert web1["bytes_received"] == 3 * 5 + 3
+        assert metrics["hosts"]["down1"]["errors"] == 1
+        assert metrics["phases"]["command"]["count"] == 3
+        assert metrics["phases"]["session_command"]["count"] == 1
+        assert metrics["phases"]["channel_open"]["count"] == 5  # 4 commands and 1 session shell
+        assert metrics["gauges"] == {"sessions_active": 1, "connections_open": 1, "channels_in_use": 1,
+                                     "jobs_running": 0}
+
+    def test_prometheus_format(self, server):
+        async def run():
+            await server.ssh_execute('we"b1', "true")
+            return await server.ssh_get_metrics(format="prometheus")
+
+        text = _run(server, run())["metrics"]
+        assert "# TYPE ssh_mcp_phase_seconds histogram" in text
+        assert 'ssh_mcp_phase_seconds_bucket{phase="command",le="+Inf"} 1' in text
+        assert 'ssh_mcp_commands_total{host="we\\"b1"} 1' in text
+        assert "ssh_mcp_sessions_active 0" in text
+        assert "error" in _run(server, server.ssh_get_metrics(format="xml"))
+
+    def test_connect_timeout_counts_as_timeout(self, real_server, monkeypatch: pytest.MonkeyPatch):
+        async def fake_connect(host, **options):
+            if host == "slow":
+                await asyncio.sleep(3600)
+            raise OSError(f"Connect call failed for {host}")
+
+        monkeypatch.setattr(asyncssh, "connect", fake_connect)
+
+        async def run():
+            slow = await real_server.ssh_execute("slow", "true", timeout=0.2)
+            await real_server.ssh_execute("down", "true")
+            return slow, await real_server.ssh_get_metrics()
+
+        slow, metrics = asyncio.run(run())
+        assert "connecting to slow" in slow["error"]
+        counters = metrics["hosts"]["slow"]
+        assert (counters["timeouts"], counters.get("errors", 0), counters.get("connect_errors", 0)) == (1, 0, 0)
+        assert metrics["hosts"]["down"]["connect_errors"] == 1
+
+    def test_connect_phases_over_real_connection(self, real_server, tmp_path: Path):
+        (tmp_path / "remote").mkdir()
+
+        async def test(_):
+            await real_server.ssh_execute(HOST_ALIAS, "true")
+            return await real_server.ssh_get_metrics()
+
+        phases = _run_with_standin(real_server, tmp_path / "remote", real_server.home, test)["phases"]
+        for phase in ("dns_tcp", "kex", "auth", "connect", "pool_acquire", "channel_open", "command", "execute"):
+            assert phases[phase]["count"] == 1, phase
+        parts = sum(phases[phase]["sum_seconds"] for phase in ("dns_tcp", "kex", "auth"))
+        assert parts <= phases["connect"]["sum_seconds"]
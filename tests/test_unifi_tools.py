@@ -0,0 +1,339 @@
+"""Tests for UniFi MCP server tools that do local processing on top of the API."""
+
+import asyncio
+import csv
+import gzip
+import hashlib
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+
+def _load_server_module(module_name: str = "unifi_server_tools_test_module"):
+    sys.modules.pop(module_name, None)
+    server_path = Path(__file__).resolve().parents[1] / "unifi-mcp" / "server.py"
+    spec = importlib.util.spec_from_file_location(module_name, server_path)
+    module = importlib.util.module_from_spec(spec)
+    assert spec.loader is not None
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def server(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setenv("UNIFI_HOST", "https://controller.invalid")
+    monkeypatch.setenv("UNIFI_API_KEY", "test-key")
+    monkeypatch.setenv("UNIFI_SITE_ID", "default")
+    monkeypatch.setenv("UNIFI_EXPORT_DIR", str(tmp_path / "exports"))
+    return _load_server_module()
+
+
+def _paged_api(rows: list[dict], calls: list | None = None, max_limit: int | None = None):
+    """Fake _api serving rows through offset/limit pagination, optionally capping limit like a controller."""
+
+    async def fake_api(method, path, params=None, body=None):
+        if calls is not None:
+            calls.append(params)
+        offset, limit = params["offset"], min(params["limit"], max_limit or params["limit"])
+        page = rows[offset:offset + limit]
+        return {"offset": offset, "limit": limit, "count": len(page), "totalCount": len(rows), "data": page}
+
+    return fake_api
+
+
+class TestExport:
+    """Tests for streaming exports to local files."""
+
+    def test_ndjson_export_streams_all_pages(self, server, monkeypatch: pytest.MonkeyPatch):
+        rows = [{"id": str(i), "name": f"client-{i}"} for i in range(450)]
+        calls: list = []
+        monkeypatch.setattr(server, "_api", _paged_api(rows, calls))
+        result = asyncio.run(server.unifi_export_clients())
+        assert result["rows"] == 450
+        assert result["pages"] == 3
+        assert len(calls) == 3
+        path = Path(result["path"])
+        assert [json.loads(line) for line in path.read_text().splitlines()] == rows
+        assert result["sha256"] == hashlib.sha256(path.read_bytes()).hexdigest()
+
+    def test_csv_export_flattens_nested_values(self, server, monkeypatch: pytest.MonkeyPatch):
+        rows = [{"id": str(i), "meta": {"vlan": i}} for i in range(server.EXPORT_PAGE_SIZE)]
+        rows.append({"id": "new", "meta": {}, "late": True})
+        monkeypatch.setattr(server, "_api", _paged_api(rows))
+        result = asyncio.run(server.unifi_export_devices(format="csv", filename="devices.csv"))
+        with open(result["path"], newline="") as fh:
+            written = list(csv.DictReader(fh))
+        assert written[1] == {"id": "1", "meta": '{"vlan":1}'}
+        assert written[-1] == {"id": "new", "meta": "{}"}
+        assert result["ignored_columns"] == ["late"]
+
+    def test_keeps_paging_when_controller_caps_limit(self, server, monkeypatch: pytest.MonkeyPatch):
+        rows = [{"id": str(i)} for i in range(450)]
+        monkeypatch.setattr(server, "_api", _paged_api(rows, max_limit=100))
+        result = asyncio.run(server.unifi_export_clients())
+        assert (result["rows"], result["pages"]) == (450, 5)
+
+    @pytest.mark.parametrize("first, later", [(None, 500), (500, 1.5), (500, "unlimited"), (True, None)])
+    def test_parquet_tolerates_types_changing_between_pages(self, server, monkeypatch: pytest.MonkeyPatch,
+                                                            first, later):
+        pq = pytest.importorskip("pyarrow.parquet")
+        rows = [{"id": str(i), "limit": first} for i in range(server.EXPORT_PAGE_SIZE)]
+        rows.append({"id": "last", "limit": later})
+        monkeypatch.setattr(server, "_api", _paged_api(rows))
+        result = asyncio.run(server.unifi_export_vouchers(format="parquet"))
+        assert result["rows"] == len(rows)
+        written = pq.read_table(result["path"]).to_pylist()
+        expected = [None if v is None else v if isinstance(v, str) else json.dumps(v) for v in (first, later)]
+        assert [written[0]["limit"], written[-1]["limit"]] == expected
+
+    def test_csv_and_parquet_write_scalars_alike(self, server, monkeypatch: pytest.MonkeyPatch):
+        pq = pytest.importorskip("pyarrow.parquet")
+        row = {"name": "ap", "enabled": True, "port": 8443, "load": 0.25, "tags": ["a"]}
+        monkeypatch.setattr(server, "_api", _paged_api([row]))
+        as_csv = asyncio.run(server.unifi_export_devices(format="csv"))
+        as_parquet = asyncio.run(server.unifi_export_devices(format="parquet"))
+        with open(as_csv["path"], newline="") as fh:
+            written = next(csv.DictReader(fh))
+        assert written == pq.read_table(as_parquet["path"]).to_pylist()[0]
+        assert written == {"name": "ap", "enabled": "true", "port": "8443", "load": "0.25", "tags": '["a"]'}
+
+    def test_cancelled_export_removes_partial_file(self, server, monkeypatch: pytest.MonkeyPatch):
+        rows = [{"id": str(i)} for i in range(server.EXPORT_PAGE_SIZE * 2)]
+        serve = _paged_api(rows)
+        first_page = asyncio.Event()
+
+        async def stalling_api(method, path, params=None, body=None):
+            if params["offset"]:
+                first_page.set()
+                await asyncio.sleep(3600)
+            return await serve(method, path, params, body)
+
+        async def run():
+            export = asyncio.ensure_future(server.unifi_export_clients(format="csv", filename="clients.csv"))
+            await first_page.wait()
+            export.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await export
+
+        monkeypatch.setattr(server, "_api", stalling_api)
+        asyncio.run(run())
+        assert not list(Path(server.UNIFI_EXPORT_DIR).iterdir())
+
+    def test_stops_when_controller_ignores_paging(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def first_page_only(method, path, params=None, body=None):
+            return {"data": [{"id": "x"}] * 25}
+
+        monkeypatch.setattr(server, "_api", first_page_only)
+        assert asyncio.run(server.unifi_export_vouchers())["rows"] == 25
+
+    def test_api_error_removes_partial_file(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def failing_api(method, path, params=None, body=None):
+            return {"error": "Unauthorized — check UNIFI_API_KEY"}
+
+        monkeypatch.setattr(server, "_api", failing_api)
+        result = asyncio.run(server.unifi_export_clients(filename="clients.ndjson"))
+        assert "Unauthorized" in result["error"]
+        assert not list(Path(server.UNIFI_EXPORT_DIR).iterdir())
+
+    @pytest.mark.parametrize("filename", ["..", "../escape.csv", "sub/dir.csv"])
+    def test_rejects_filenames_outside_export_dir(self, server, filename):
+        result = asyncio.run(server.unifi_export_clients(filename=filename))
+        assert "Invalid filename" in result["error"]
+
+    def test_rejects_unknown_format(self, server):
+        assert "Invalid format" in asyncio.run(server.unifi_export_clients(format="xlsx"))["error"]
+
+
+class TestTrafficMatchingListEdits:
+    """Tests for incremental item edits on traffic matching lists."""
+
+    @staticmethod
+    def _fake_list_api(items: list[dict], puts: list):
+        current = {"id": "list-1", "name": "blocklist", "type": "IPV4_ADDRESSES", "items": items}
+
+        async def fake_api(method, path, params=None, body=None):
+            if method == "PUT":
+                puts.append(body)
+                return body
+            return current
+
+        return fake_api
+
+    def test_add_skips_put_when_items_already_present(self, server, monkeypatch: pytest.MonkeyPatch):
+        puts: list = []
+        monkeypatch.setattr(server, "_api", self._fake_list_api([{"type": "IP_ADDRESS", "value": "10.0.0.1"}], puts))
+        result = asyncio.run(server.unifi_add_traffic_matching_list_items("list-1", [{"type": "SUBNET", "value": "10.0.0.1/32"}]))
+        assert result == {"status": "unchanged", "item_count": 1}
+        assert puts == []
+
+    def test_add_and_remove_send_full_updated_list(self, server, monkeypatch: pytest.MonkeyPatch):
+        puts: list = []
+        items = [{"type": "IP_ADDRESS", "value": f"192.0.2.{i}"} for i in range(1, 4)]
+        monkeypatch.setattr(server, "_api", self._fake_list_api(items, puts))
+        result = asyncio.run(server.unifi_remove_traffic_matching_list_items("list-1", [{"type": "IP_ADDRESS", "value": "192.0.2.2"}]))
+        assert result["status"] == "updated"
+        assert result["removed"] == 1
+        assert puts[0]["name"] == "blocklist"
+        assert "id" not in puts[0]
+        assert [i["value"] for i in puts[0]["items"]] == ["192.0.2.1", "192.0.2.3"]
+
+    def test_aggregate_skips_put_for_unsorted_list(self, server, monkeypatch: pytest.MonkeyPatch):
+        puts: list = []
+        items = [{"type": "SUBNET", "value": "10.0.2.0/24"}, {"type": "SUBNET", "value": "10.0.1.0/24"}]
+        monkeypatch.setattr(server, "_api", self._fake_list_api(items, puts))
+        result = asyncio.run(server.unifi_add_traffic_matching_list_items("list-1", [items[0]], aggregate=True))
+        assert result == {"status": "unchanged", "item_count": 2}
+        assert puts == []
+
+    def test_aggregate_remove_reports_carved_prefixes(self, server, monkeypatch: pytest.MonkeyPatch):
+        puts: list = []
+        monkeypatch.setattr(server, "_api", self._fake_list_api([{"type": "SUBNET", "value": "10.0.0.0/24"}], puts))
+        hole = {"type": "IP_ADDRESS", "value": "10.0.0.5"}
+        result = asyncio.run(server.unifi_remove_traffic_matching_list_items("list-1", [hole], aggregate=True))
+        assert result["removed"] == 0
+        assert result["carved_out"] == [hole]
+        assert result["replaced"] == [{"type": "SUBNET", "value": "10.0.0.0/24"}]
+        assert len(result["replaced_with"]) == result["item_count"] == 8
+        assert puts[0]["items"] == result["replaced_with"]
+
+    def test_aggregate_collapses_adjacent_prefixes(self, server):
+        items = [
+            {"type": "SUBNET", "value": "10.0.0.0/25"},
+            {"type": "SUBNET", "value": "10.0.0.128/25"},
+            {"type": "IP_ADDRESS", "value": "10.0.0.7"},
+            {"type": "IP_ADDRESS", "value": "2001:db8::1"},
+            {"type": "IP_ADDRESS_RANGE", "start": "172.16.0.1", "stop": "172.16.0.9"},
+        ]
+        assert server._aggregate_items(items) == [
+            {"type": "IP_ADDRESS_RANGE", "start": "172.16.0.1", "stop": "172.16.0.9"},
+            {"type": "SUBNET", "value": "10.0.0.0/24"},
+            {"type": "IP_ADDRESS", "value": "2001:db8::1"},
+        ]
+
+    def test_aggregate_remove_carves_out_of_subnet(self, server):
+        items = [{"type": "SUBNET", "value": "10.0.0.0/30"}]
+        result = server._aggregate_items(items, exclude=[{"type": "IP_ADDRESS", "value": "10.0.0.0"}])
+        assert result == [
+            {"type": "IP_ADDRESS", "value": "10.0.0.1"},
+            {"type": "SUBNET", "value": "10.0.0.2/31"},
+        ]
+
+
+class TestAclEvaluation:
+    """Tests for the offline ACL rule evaluator."""
+
+    NETWORKS = [
+        {"id": "net-iot", "ipv4Configuration": {"hostIpAddress": "10.0.20.1", "prefixLength": 24}},
+        {"id": "net-mgmt", "ipv4Configuration": {"subnet": "10.0.1.0/24"}},
+    ]
+    RULES = [
+        {"id": "r-allow-dns", "name": "IoT DNS", "action": "ALLOW", "index": 1, "protocolFilter": ["UDP"],
+         "sourceFilter": {"type": "NETWORKS", "networkIds": ["net-iot"]},
+         "destinationFilter": {"type": "IP_ADDRESSES_OR_SUBNETS", "ipAddressesOrSubnets": ["10.0.1.53"]}},
+        {"id": "r-block", "name": "IoT to mgmt", "action": "BLOCK", "index": 2,
+         "sourceFilter": {"type": "NETWORKS", "networkIds": ["net-iot"]},
+         "destinationFilter": {"type": "NETWORKS", "networkIds": ["net-mgmt"]}},
+        {"id": "r-dead", "name": "Camera to mgmt", "action": "ALLOW", "index": 3,
+         "sourceFilter": {"type": "IP_ADDRESSES_OR_SUBNETS", "ipAddressesOrSubnets": ["10.0.20.64/26"]},
+         "destinationFilter": {"type": "IP_ADDRESSES_OR_SUBNETS", "ipAddressesOrSubnets": ["10.0.1.10"]}},
+        {"id": "r-disabled", "name": "Off", "action": "ALLOW", "index": 0, "enabled": False},
+        {"id": "r-missing", "name": "Stale", "action": "BLOCK", "index": 4,
+         "sourceFilter": {"type": "NETWORKS", "networkIds": ["net-gone"]}},
+    ]
+
+    def test_first_match_by_index(self, server):
+        evaluator = server._AclEvaluator(self.RULES, self.NETWORKS)
+        flows = [
+            {"source": "10.0.20.5", "destination": "10.0.1.53", "protocol": "udp"},
+            {"source": "10.0.20.5", "destination": "10.0.1.53", "protocol": "TCP"},
+            {"source": "10.0.20.70", "destination": "10.0.1.10"},
+            {"source": "192.168.1.5", "destination": "10.0.1.10"},
+            {"source": "not-an-ip", "destination": "10.0.1.10"},
+        ]
+        results = [evaluator.evaluate(flow) for flow in flows]
+        assert [r.get("rule_id") for r in results[:4]] == ["r-allow-dns", "r-block", "r-block", None]
+        assert results[3]["action"] == "DEFAULT"
+        assert "error" in results[4]
+
+    def test_ipv6_and_ipv4_do_not_collide(self, server):
+        rules = [{"id": "v6", "action": "BLOCK", "index": 1,
+                  "sourceFilter": {"ipAddressesOrSubnets": ["::/96"]}}]
+        evaluator = server._AclEvaluator(rules, [])
+        assert evaluator.evaluate({"source": "::1", "destination": "10.0.0.1"})["rule_id"] == "v6"
+        assert evaluator.evaluate({"source": "0.0.0.1", "destination": "10.0.0.1"})["rule_id"] is None
+
+    def test_reports_shadowed_and_unresolvable_rules(self, server):
+        findings = {f["rule_id"]: f for f in server._AclEvaluator(self.RULES, self.NETWORKS).shadowed()}
+        assert findings["r-dead"]["shadowed_by"] == "r-block"
+        assert findings["r-dead"]["conflicting"] is True
+        assert findings["r-missing"]["unresolved"] == ["net-gone"]
+        assert "r-allow-dns" not in findings and "r-block" not in findings
+
+    def test_tool_pages_rules_and_networks(self, server, monkeypatch: pytest.MonkeyPatch):
+        async def fake_api(method, path, params=None, body=None):
+            data = self.RULES if path.endswith("acl-rules") else self.NETWORKS
+            return {"data": data, "totalCount": len(data)}
+
+        monkeypatch.setattr(server, "_api", fake_api)
+        result = asyncio.run(server.unifi_evaluate_acl([{"source": "10.0.20.5", "destination": "10.0.1.1"}]))
+        assert result["rule_count"] == 4
+        assert result["results"][0]["action"] == "BLOCK"
+        assert {f["rule_id"] for f in result["shadowed_rules"]} == {"r-dead", "r-missing"}
+
+
+class TestRecordReplay:
+    """Tests for the cassette record/replay transport."""
+
+    def test_records_then_replays_without_controller(self, server, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        import httpx
+
+        cassette = str(tmp_path / "site.ndjson.gz")
+        served: list[str] = []
+
+        def controller(request: httpx.Request) -> httpx.Response:
+            served.append(request.url.path)
+            return httpx.Response(200, json={"data": [{"id": f"dev-{len(served)}"}]})
+
+        recorder = server._RecordingTransport(cassette, httpx.MockTransport(controller))
+        monkeypatch.setattr(server, "_client", httpx.AsyncClient(transport=recorder))
+        recorded = asyncio.run(server.unifi_list_devices())
+        asyncio.run(server._client.aclose())
+        assert recorded == {"data": [{"id": "dev-1"}]}
+        assert "test-key" not in gzip.open(cassette, "rt").read()
+        assert Path(cassette).stat().st_mode & 0o777 == 0o600
+
+        monkeypatch.setattr(server, "UNIFI_HOST", "")
+        monkeypatch.setattr(server, "UNIFI_API_KEY", "")
+        monkeypatch.setattr(server, "UNIFI_CASSETTE_MODE", "replay")
+        replay = server._ReplayTransport(cassette, latency_scale=0)
+        monkeypatch.setattr(server, "_client", httpx.AsyncClient(transport=replay))
+        assert asyncio.run(server.unifi_list_devices()) == recorded
+        assert asyncio.run(server.unifi_list_devices()) == recorded
+        assert served == ["/proxy/network/integration/v1/sites/default/devices"]
+        assert "No recorded response" in asyncio.run(server.unifi_list_clients())["error"]
+
+    def test_records_gzip_encoded_responses(self, server, monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+        import httpx
+
+        def controller(request: httpx.Request) -> httpx.Response:
+            body = gzip.compress(json.dumps({"data": [{"id": "dev-1"}]}).encode())
+            return httpx.Response(200, content=body, headers={"Content-Type": "application/json",
+                                                               "Content-Encoding": "gzip"})
+
+        recorder = server._RecordingTransport(str(tmp_path / "site.ndjson"), httpx.MockTransport(controller))
+        monkeypatch.setattr(server, "_client", httpx.AsyncClient(transport=recorder))
+        assert asyncio.run(server.unifi_list_devices()) == {"data": [{"id": "dev-1"}]}
+        asyncio.run(server._client.aclose())
+        entry = json.loads((tmp_path / "site.ndjson").read_text())
+        assert json.loads(entry["content"]) == {"data": [{"id": "dev-1"}]}
+        assert (tmp_path / "site.ndjson").stat().st_mode & 0o777 == 0o600
+
+    def test_query_order_does_not_affect_matching(self, server):
+        import httpx
+
+        a = httpx.Request("GET", "https://a/x", params={"offset": 0, "limit": 200})
+        b = httpx.Request("GET", "https://b/x", params={"limit": 200, "offset": 0})
+        assert server._cassette_key(a) == server._cassette_key(b)
@@ -1,11 +1,22 @@
 """UniFi Network MCP Server — exposes UniFi Network API v10.0.162 as MCP tools."""
 
+import asyncio
 import atexit
+import base64
+import bisect
+import csv
+import gzip
+import hashlib
+import ipaddress
+import json
 import logging
 import os
 import re
 import ssl
-from typing import Any
+from collections import deque
+from pathlib import Path
+from time import perf_counter, strftime
+from typing import Any, AsyncIterator
 
 import httpx
 from mcp.server.fastmcp import FastMCP
@@ -19,6 +30,19 @@ UNIFI_HOST = os.environ.get("UNIFI_HOST", "")
 UNIFI_API_KEY = os.environ.get("UNIFI_API_KEY", "")
 UNIFI_SITE_ID = os.environ.get("UNIFI_SITE_ID", "")
 
+# Exports are written here; filenames passed to unifi_export_* tools never leave this directory.
+UNIFI_EXPORT_DIR = os.environ.get("UNIFI_EXPORT_DIR", "exports")
+EXPORT_PAGE_SIZE = 200
+EXPORT_FORMATS = {"ndjson": ".ndjson", "csv": ".csv", "parquet": ".parquet"}
+
+# Record/replay: UNIFI_CASSETTE_MODE=record saves every controller exchange to UNIFI_CASSETTE
+# (NDJSON, gzipped if the path ends in .gz); replay serves them back without a controller,
+# sleeping for the recorded latency multiplied by UNIFI_REPLAY_LATENCY_SCALE (0 disables it).
+UNIFI_CASSETTE = os.environ.get("UNIFI_CASSETTE", "")
+UNIFI_CASSETTE_MODE = os.environ.get("UNIFI_CASSETTE_MODE", "").lower()
+UNIFI_REPLAY_LATENCY_SCALE = float(os.environ.get("UNIFI_REPLAY_LATENCY_SCALE", "1.0"))
+_REPLAY_HOST = "https://unifi.replay"
+
 # SSL verification keeps the default httpx/Python behavior unless explicitly configured.
 # Set UNIFI_SSL_VERIFY=false to disable, UNIFI_CA_BUNDLE to a cert path, or
 # UNIFI_SSL_USE_TRUSTSTORE=true to opt into the platform trust store.
@@ -99,8 +123,6 @@ def _cleanup_http_client() -> None:
         _client = None
         return
 
-    import asyncio
-
     try:
         asyncio.run(_client.aclose())
     except RuntimeError:
@@ -116,18 +138,110 @@ def _cleanup_http_client() -> None:
 atexit.register(_cleanup_http_client)
 
 
+# ── Record/Replay Transport ──
+
+
+def _cassette_key(request: httpx.Request) -> str:
+    """Match key for an exchange — host and headers are ignored so cassettes replay against any controller."""
+    query = "&".join(sorted(request.url.query.decode().split("&"))) if request.url.query else ""
+    body_hash = hashlib.sha256(request.content).hexdigest()[:16] if request.content else ""
+    return f"{request.method} {request.url.path}?{query} {body_hash}"
+
+
+def _open_cassette(path: str, mode: str):
+    if mode == "a":
+        # Recordings hold full controller responses (voucher codes, client MACs), so create them private
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+    return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") else open(path, mode, encoding="utf-8")
+
+
+class _RecordingTransport(httpx.AsyncBaseTransport):
+    """Pass requests through to the controller and append each exchange to a cassette.
+
+    The API key and other request headers are never written.
+    """
+
+    def __init__(self, path: str, inner: httpx.AsyncBaseTransport):
+        self._inner = inner
+        self._fh = _open_cassette(path, "a")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = perf_counter()
+        response = await self._inner.handle_async_request(request)
+        content = await response.aread()
+        elapsed = perf_counter() - start
+        entry = {"key": _cassette_key(request), "status": response.status_code, "elapsed": round(elapsed, 6),
+                 "content_type": response.headers.get("content-type", "")}
+        try:
+            entry["content"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["content_b64"] = base64.b64encode(content).decode("ascii")
+        self._fh.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._fh.flush()
+        # aread() already decoded the body, so drop headers that describe the encoded form
+        headers = [(k, v) for k, v in response.headers.multi_items()
+                   if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self) -> None:
+        self._fh.close()
+        await self._inner.aclose()
+
+
+class _ReplayTransport(httpx.AsyncBaseTransport):
+    """Serve recorded exchanges in order per request key, repeating the last one once a key is exhausted."""
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        self._latency_scale = latency_scale
+        self._entries: dict[str, deque] = {}
+        with _open_cassette(path, "r") as fh:
+            try:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], deque()).append(entry)
+            except EOFError:
+                logger.warning("Cassette %s was not closed cleanly; replaying the exchanges read so far", path)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = _cassette_key(request)
+        queue = self._entries.get(key)
+        if not queue:
+            raise httpx.ConnectError(f"No recorded response for {key}", request=request)
+        entry = queue.popleft() if len(queue) > 1 else queue[0]
+        if self._latency_scale > 0:
+            await asyncio.sleep(entry["elapsed"] * self._latency_scale)
+        content = base64.b64decode(entry["content_b64"]) if "content_b64" in entry else entry.get("content", "").encode("utf-8")
+        headers = {"content-type": entry["content_type"]} if entry.get("content_type") else {}
+        return httpx.Response(entry["status"], headers=headers, content=content, request=request)
+
+
+def _build_transport() -> httpx.AsyncBaseTransport | None:
+    if not UNIFI_CASSETTE_MODE:
+        return None
+    if not UNIFI_CASSETTE:
+        raise ValueError("UNIFI_CASSETTE_MODE requires UNIFI_CASSETTE to point at a cassette file")
+    if UNIFI_CASSETTE_MODE == "record":
+        return _RecordingTransport(UNIFI_CASSETTE, httpx.AsyncHTTPTransport(verify=SSL_VERIFY))
+    if UNIFI_CASSETTE_MODE == "replay":
+        return _ReplayTransport(UNIFI_CASSETTE, UNIFI_REPLAY_LATENCY_SCALE)
+    raise ValueError("UNIFI_CASSETTE_MODE must be 'record' or 'replay'")
+
+
 async def _get_client() -> httpx.AsyncClient:
     """Return a reusable HTTP client with connection pooling."""
     global _client
     if _client is None or _client.is_closed:
-        _client = httpx.AsyncClient(verify=SSL_VERIFY, timeout=30)
+        _client = httpx.AsyncClient(verify=SSL_VERIFY, timeout=30, transport=_build_transport())
     return _client
 
 
 async def _api(method: str, path: str, params: dict | None = None, body: Any = None) -> Any:
-    if not UNIFI_HOST or not UNIFI_API_KEY:
+    replaying = UNIFI_CASSETTE_MODE == "replay"
+    if not replaying and (not UNIFI_HOST or not UNIFI_API_KEY):
         raise ValueError("Set UNIFI_HOST and UNIFI_API_KEY environment variables")
-    url = f"{UNIFI_HOST.rstrip('/')}/proxy/network/integration{path}"
+    host = UNIFI_HOST or _REPLAY_HOST
+    url = f"{host.rstrip('/')}/proxy/network/integration{path}"
     headers = {"X-API-KEY": UNIFI_API_KEY, "Content-Type": "application/json"}
     client = await _get_client()
     try:
@@ -142,6 +256,166 @@ async def _api(method: str, path: str, params: dict | None = None, body: Any = N
         return {"error": str(e)}
 
 
+async def _paginate(path: str, page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[list[dict]]:
+    """Yield a list endpoint one page at a time using offset/limit.
+
+    When the response carries totalCount, paging continues until that many rows have been
+    read, even past short pages (the controller may cap limit below page_size). Without
+    totalCount, a short page ends the listing. An empty page always ends it.
+    """
+    offset = 0
+    while True:
+        page = await _api("GET", path, params={"offset": offset, "limit": page_size})
+        if isinstance(page, dict) and "error" in page:
+            raise RuntimeError(page["error"])
+        rows = page.get("data", []) if isinstance(page, dict) else page
+        if not rows:
+            return
+        yield rows
+        offset += len(rows)
+        total = page.get("totalCount") if isinstance(page, dict) else None
+        if total is not None:
+            if offset >= total:
+                return
+        elif len(rows) < page_size:
+            return
+
+
+# ── Export Writers ──
+
+
+def _cell_text(value: Any) -> str | None:
+    """Text for one CSV/Parquet cell: strings as-is, anything else (bools, numbers, nested values) as JSON."""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+
+class _NdjsonWriter:
+    def __init__(self, path: Path):
+        self._fh = path.open("w", encoding="utf-8")
+        self.ignored_columns: set[str] = set()
+
+    def write(self, rows: list[dict]) -> None:
+        for row in rows:
+            self._fh.write(json.dumps(row, separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class _CsvWriter:
+    """CSV writer whose columns are fixed by the first page; later unknown keys are reported, not written."""
+
+    def __init__(self, path: Path):
+        self._fh = path.open("w", encoding="utf-8", newline="")
+        self._writer: csv.DictWriter | None = None
+        self.ignored_columns: set[str] = set()
+
+    def write(self, rows: list[dict]) -> None:
+        if self._writer is None:
+            columns = list(dict.fromkeys(k for row in rows for k in row))
+            self._writer = csv.DictWriter(self._fh, fieldnames=columns, extrasaction="ignore")
+            self._writer.writeheader()
+        known = set(self._writer.fieldnames)
+        for row in rows:
+            self.ignored_columns.update(row.keys() - known)
+            self._writer.writerow({k: _cell_text(v) for k, v in row.items()})
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class _ParquetWriter:
+    """Columnar writer — each page becomes one row group, columns fixed by the first page.
+
+    Every column is stored as a string, as in CSV: a schema inferred from the first page would break
+    the export when a later page holds a different type (null then int, int then float or str).
+    """
+
+    def __init__(self, path: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise RuntimeError("format='parquet' requires the optional pyarrow package") from exc
+        self._pa = pa
+        self._pq = pq
+        self._path = path
+        self._writer = None
+        self._schema = None
+        self.ignored_columns: set[str] = set()
+
+    def write(self, rows: list[dict]) -> None:
+        if self._writer is None:
+            columns = list(dict.fromkeys(k for row in rows for k in row))
+            self._schema = self._pa.schema([(name, self._pa.string()) for name in columns])
+            self._writer = self._pq.ParquetWriter(str(self._path), self._schema)
+        known = set(self._schema.names)
+        for row in rows:
+            self.ignored_columns.update(row.keys() - known)
+        text = [{k: _cell_text(row.get(k)) for k in self._schema.names} for row in rows]
+        self._writer.write_table(self._pa.Table.from_pylist(text, schema=self._schema))
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+_EXPORT_WRITERS = {"ndjson": _NdjsonWriter, "csv": _CsvWriter, "parquet": _ParquetWriter}
+
+
+def _export_path(resource: str, fmt: str, filename: str | None) -> Path:
+    """Resolve an export target inside UNIFI_EXPORT_DIR, rejecting anything that escapes it."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format: must be one of {', '.join(EXPORT_FORMATS)}")
+    export_dir = Path(UNIFI_EXPORT_DIR).resolve()
+    name = _validate_id(filename, "filename") if filename else f"{resource}-{strftime('%Y%m%dT%H%M%S')}{EXPORT_FORMATS[fmt]}"
+    target = (export_dir / name).resolve()
+    if target.parent != export_dir:
+        raise ValueError("Invalid filename: must not leave UNIFI_EXPORT_DIR")
+    export_dir.mkdir(parents=True, exist_ok=True)
+    return target
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _export(resource: str, api_path: str, fmt: str, filename: str | None) -> dict:
+    """Stream every page of a list endpoint to a local file, holding one page in memory at a time."""
+    try:
+        target = _export_path(resource, fmt, filename)
+        writer = _EXPORT_WRITERS[fmt](target)
+    except (ValueError, RuntimeError, OSError) as e:
+        return {"error": str(e)}
+    rows = pages = 0
+    complete = False
+    try:
+        async for page in _paginate(api_path):
+            writer.write(page)
+            rows += len(page)
+            pages += 1
+        complete = True
+    except Exception as e:
+        return {"error": f"Export failed after {rows} rows: {e}"}
+    finally:
+        # Also runs on cancellation, so no open writer or partial file is left behind
+        writer.close()
+        if not complete:
+            target.unlink(missing_ok=True)
+    result = {"path": str(target), "format": fmt, "rows": rows, "pages": pages,
+              "bytes": target.stat().st_size if target.exists() else 0,
+              "sha256": _sha256_file(target) if target.exists() else None}
+    if writer.ignored_columns:
+        result["ignored_columns"] = sorted(writer.ignored_columns)
+    return result
+
+
 # ── Pydantic Input Models ──
 
 
@@ -433,6 +707,174 @@ async def unifi_delete_firewall_zone(zone_id: str, site_id: str | None = None) -
     return await _api("DELETE", f"/v1/sites/{_site(site_id)}/firewall/zones/{_validate_id(zone_id, 'zone_id')}")
 
 
+# ── ACL Rule Evaluation ──
+
+# IPv6 addresses are shifted above the IPv4 space so both families share one interval index
+_IPV6_OFFSET = 1 << 32
+
+
+def _addr_key(address: str) -> int:
+    ip = ipaddress.ip_address(address)
+    return int(ip) + (_IPV6_OFFSET if ip.version == 6 else 0)
+
+
+def _network_subnet(network: dict) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    """Subnet of a network resource — accepts either ipv4Configuration.subnet or hostIpAddress/prefixLength."""
+    cfg = network.get("ipv4Configuration") or {}
+    value = cfg.get("subnet")
+    if not value and cfg.get("hostIpAddress") and cfg.get("prefixLength") is not None:
+        value = f"{cfg['hostIpAddress']}/{cfg['prefixLength']}"
+    try:
+        return ipaddress.ip_network(value, strict=False) if value else None
+    except ValueError:
+        return None
+
+
+class _AclSide:
+    """Address match set for one side of a rule. ``nets``/``macs`` of None mean "any"."""
+
+    def __init__(self, flt: dict | None, subnets: dict[str, Any]):
+        self.nets: list | None = None
+        self.macs: frozenset[str] | None = None
+        self.unresolved: list[str] = []
+        if not flt:
+            return
+        if "macAddresses" in flt:
+            self.macs = frozenset(m.lower() for m in flt.get("macAddresses") or [])
+        if "ipAddressesOrSubnets" in flt or "networkIds" in flt:
+            nets = []
+            for value in flt.get("ipAddressesOrSubnets") or []:
+                try:
+                    nets.append(ipaddress.ip_network(value, strict=False))
+                except ValueError:
+                    self.unresolved.append(value)
+            for network_id in flt.get("networkIds") or []:
+                if subnets.get(network_id) is None:
+                    self.unresolved.append(network_id)
+                else:
+                    nets.append(subnets[network_id])
+            self.nets = list(ipaddress.collapse_addresses([n for n in nets if n.version == 4]))
+            self.nets += list(ipaddress.collapse_addresses([n for n in nets if n.version == 6]))
+
+    @property
+    def is_any(self) -> bool:
+        return self.nets is None and self.macs is None
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.is_any and not self.nets and not self.macs
+
+    def covered_by(self, other: "_AclSide") -> bool:
+        if other.is_any:
+            return True
+        if self.is_any:
+            return False
+        if self.macs and not (other.macs is not None and self.macs <= other.macs):
+            return False
+        if self.nets:
+            if other.nets is None:
+                return False
+            return all(any(n.version == o.version and n.subnet_of(o) for o in other.nets) for n in self.nets)
+        return True
+
+
+class _AclSideIndex:
+    """Maps an address (or MAC) to a bitmask of the rules that match it on one side.
+
+    Addresses are indexed as elementary intervals between sorted range boundaries, so a
+    lookup is one bisect regardless of how many rules or prefixes there are.
+    """
+
+    def __init__(self, sides: list[_AclSide]):
+        self.any_mask = 0
+        self.macs: dict[str, int] = {}
+        events: dict[int, int] = {}
+        for bit, side in enumerate(sides):
+            if side.is_any:
+                self.any_mask |= 1 << bit
+                continue
+            for mac in side.macs or ():
+                self.macs[mac] = self.macs.get(mac, 0) | 1 << bit
+            for net in side.nets or ():
+                offset = _IPV6_OFFSET if net.version == 6 else 0
+                start = int(net.network_address) + offset
+                # A rule's own prefixes are collapsed, so toggling its bit at each edge is exact
+                events[start] = events.get(start, 0) ^ 1 << bit
+                events[start + net.num_addresses] = events.get(start + net.num_addresses, 0) ^ 1 << bit
+        self.bounds: list[int] = sorted(events)
+        self.masks: list[int] = []
+        mask = 0
+        for bound in self.bounds:
+            mask ^= events[bound]
+            self.masks.append(mask)
+
+    def lookup(self, address: str | None, mac: str | None) -> int:
+        mask = self.any_mask
+        if address:
+            pos = bisect.bisect_right(self.bounds, _addr_key(address)) - 1
+            if pos >= 0:
+                mask |= self.masks[pos]
+        if mac:
+            mask |= self.macs.get(mac.lower(), 0)
+        return mask
+
+
+class _AclEvaluator:
+    """First-match-wins evaluator over enabled ACL rules ordered by index."""
+
+    def __init__(self, rules: list[dict], networks: list[dict]):
+        subnets = {n.get("id"): _network_subnet(n) for n in networks}
+        enabled = [(r.get("index") if r.get("index") is not None else float("inf"), pos, r)
+                   for pos, r in enumerate(rules) if r.get("enabled", True)]
+        self.rules = [r for _, _, r in sorted(enabled, key=lambda t: t[:2])]
+        self.src = [_AclSide(r.get("sourceFilter"), subnets) for r in self.rules]
+        self.dst = [_AclSide(r.get("destinationFilter"), subnets) for r in self.rules]
+        self.protocols = [frozenset(p.upper() for p in r["protocolFilter"]) if r.get("protocolFilter") else None
+                          for r in self.rules]
+        self._src_index = _AclSideIndex(self.src)
+        self._dst_index = _AclSideIndex(self.dst)
+        self._any_protocol = 0
+        self._protocol_masks: dict[str, int] = {}
+        for bit, protocols in enumerate(self.protocols):
+            if protocols is None:
+                self._any_protocol |= 1 << bit
+            for proto in protocols or ():
+                self._protocol_masks[proto] = self._protocol_masks.get(proto, 0) | 1 << bit
+
+    def _summary(self, bit: int) -> dict:
+        rule = self.rules[bit]
+        return {"rule_id": rule.get("id"), "name": rule.get("name"), "index": rule.get("index"), "action": rule.get("action")}
+
+    def evaluate(self, flow: dict) -> dict:
+        """Return the first rule matching a flow {source, destination, protocol, sourceMac, destinationMac}."""
+        try:
+            mask = self._src_index.lookup(flow.get("source"), flow.get("sourceMac"))
+            mask &= self._dst_index.lookup(flow.get("destination"), flow.get("destinationMac"))
+        except ValueError as e:
+            return {"error": str(e)}
+        protocol = (flow.get("protocol") or "").upper()
+        mask &= self._any_protocol | self._protocol_masks.get(protocol, 0)
+        if not mask:
+            return {"rule_id": None, "action": "DEFAULT"}
+        return self._summary((mask & -mask).bit_length() - 1)
+
+    def shadowed(self) -> list[dict]:
+        """Rules that can never match: empty match sets, or fully covered by a single earlier rule."""
+        findings = []
+        for i, rule in enumerate(self.rules):
+            unresolved = self.src[i].unresolved + self.dst[i].unresolved
+            if self.src[i].is_empty or self.dst[i].is_empty or self.protocols[i] == frozenset():
+                findings.append({**self._summary(i), "reason": "matches nothing", "unresolved": unresolved})
+                continue
+            for j in range(i):
+                covers_protocol = self.protocols[j] is None or (self.protocols[i] is not None and self.protocols[i] <= self.protocols[j])
+                if covers_protocol and self.src[i].covered_by(self.src[j]) and self.dst[i].covered_by(self.dst[j]):
+                    findings.append({**self._summary(i), "reason": "shadowed", "shadowed_by": self._summary(j)["rule_id"],
+                                     "conflicting": self.rules[j].get("action") != rule.get("action")})
+                    break
+        return findings
+
+
 # ── Tools: ACL Rules ──
 
 
@@ -455,6 +897,24 @@ async def unifi_create_acl_rule(config: AclRuleConfig, site_id: str | None = Non
     return await _api("POST", f"/v1/sites/{_site(site_id)}/acl-rules", body=config.model_dump(exclude_none=True))
 
 
+@mcp.tool(annotations={"readOnlyHint": True})
+async def unifi_evaluate_acl(flows: list[dict], check_shadowing: bool = True, site_id: str | None = None) -> Any:
+    """Evaluate flows against the site's ACL rules locally (first match by index wins).
+    Each flow is a dict with source, destination (IPs), optional protocol, sourceMac, destinationMac.
+    Returns the matching rule per flow (action DEFAULT when none match) and, optionally, shadowed rules."""
+    site = _site(site_id)
+    try:
+        rules = [r async for page in _paginate(f"/v1/sites/{site}/acl-rules") for r in page]
+        networks = [n async for page in _paginate(f"/v1/sites/{site}/networks") for n in page]
+    except RuntimeError as e:
+        return {"error": str(e)}
+    evaluator = _AclEvaluator(rules, networks)
+    result = {"rule_count": len(evaluator.rules), "results": [evaluator.evaluate(flow) for flow in flows]}
+    if check_shadowing:
+        result["shadowed_rules"] = evaluator.shadowed()
+    return result
+
+
 @mcp.tool(annotations={"idempotentHint": True})
 async def unifi_update_acl_rule(rule_id: str, config: AclRuleConfig, site_id: str | None = None) -> Any:
     """Update an existing ACL rule by ID. Provide full AclRuleConfig (PUT semantics)."""
@@ -467,6 +927,118 @@ async def unifi_delete_acl_rule(rule_id: str, site_id: str | None = None) -> Any
     return await _api("DELETE", f"/v1/sites/{_site(site_id)}/acl-rules/{_validate_id(rule_id, 'rule_id')}")
 
 
+# ── Traffic Matching List Editing ──
+
+# Item types that hold a single address or prefix in "value" and can be aggregated
+_PREFIX_ITEM_TYPES = {"IP_ADDRESS", "SUBNET"}
+
+
+def _as_network(item: dict) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    if item.get("type") not in _PREFIX_ITEM_TYPES:
+        return None
+    try:
+        return ipaddress.ip_network(str(item.get("value")), strict=False)
+    except ValueError:
+        return None
+
+
+def _network_item(net: ipaddress.IPv4Network | ipaddress.IPv6Network) -> dict:
+    if net.num_addresses == 1:
+        return {"type": "IP_ADDRESS", "value": str(net.network_address)}
+    return {"type": "SUBNET", "value": str(net)}
+
+
+def _item_key(item: dict) -> str:
+    """Hashable identity for an item, so 10.0.0.1 and 10.0.0.1/32 compare equal."""
+    net = _as_network(item)
+    if net is not None:
+        return f"net:{net}"
+    return json.dumps(item, sort_keys=True, separators=(",", ":"))
+
+
+def _aggregate_items(items: list[dict], exclude: list[dict] | None = None) -> list[dict]:
+    """Collapse prefix items per address family, optionally carving out excluded prefixes.
+
+    Non-prefix items (ranges, ports) are kept as-is, ahead of the aggregated prefixes.
+    """
+    others: list[dict] = []
+    nets: dict[int, list] = {4: [], 6: []}
+    for item in items:
+        net = _as_network(item)
+        if net is None:
+            others.append(item)
+        else:
+            nets[net.version].append(net)
+    holes: dict[int, list] = {4: [], 6: []}
+    for item in exclude or []:
+        net = _as_network(item)
+        if net is not None:
+            holes[net.version].append(net)
+    result = others
+    for version in (4, 6):
+        collapsed = list(ipaddress.collapse_addresses(nets[version]))
+        for hole in ipaddress.collapse_addresses(holes[version]):
+            remaining = []
+            for net in collapsed:
+                if net.subnet_of(hole):
+                    continue
+                if hole.subnet_of(net):
+                    remaining.extend(net.address_exclude(hole))
+                else:
+                    remaining.append(net)
+            collapsed = list(ipaddress.collapse_addresses(remaining))
+        result.extend(_network_item(net) for net in collapsed)
+    return result
+
+
+async def _edit_traffic_matching_list(site: str, list_id: str, add: list[dict] | None = None,
+                                      remove: list[dict] | None = None, aggregate: bool = False) -> dict:
+    """Fetch a list, apply an item-level set diff locally and PUT only when the items change."""
+    path = f"/v1/sites/{site}/traffic-matching-lists/{list_id}"
+    current = await _api("GET", path)
+    if "error" in current:
+        return current
+    before = current.get("items") or []
+    index = {_item_key(item): item for item in before}
+    added = removed = 0
+    for item in add or []:
+        key = _item_key(item)
+        if key not in index:
+            index[key] = item
+            added += 1
+    for item in remove or []:
+        if index.pop(_item_key(item), None) is not None:
+            removed += 1
+    edited = list(index.values())
+    after, carved = edited, []
+    if aggregate:
+        after = _aggregate_items(edited, exclude=remove)
+        nets = [net for net in map(_as_network, edited) if net is not None]
+        for item in remove or []:
+            hole = _as_network(item)
+            if hole is not None and any(net.version == hole.version and hole.subnet_of(net) for net in nets):
+                carved.append(item)
+    # The controller does not care about item order, so neither does the no-op check
+    if sorted(_item_key(i) for i in after) == sorted(_item_key(i) for i in before):
+        return {"status": "unchanged", "item_count": len(before)}
+    config = TrafficMatchingListConfig(**{k: v for k, v in current.items() if k not in ("id", "metadata")} | {"items": after})
+    result = await _api("PUT", path, body=config.model_dump(exclude_none=True))
+    if "error" in result:
+        return result
+    response = {"status": "updated", "added": added, "removed": removed, "item_count": len(after),
+                "previous_item_count": len(before)}
+    if aggregate:
+        # Report entries that aggregation or carving rewrote, beyond the explicit adds and removes
+        edited_keys, after_keys = {_item_key(i) for i in edited}, {_item_key(i) for i in after}
+        replaced = [i for i in edited if _item_key(i) not in after_keys]
+        replaced_with = [i for i in after if _item_key(i) not in edited_keys]
+        if carved:
+            response["carved_out"] = carved
+        if replaced or replaced_with:
+            response |= {"replaced": replaced, "replaced_with": replaced_with}
+    return response
+
+
 # ── Tools: Traffic Matching Lists ──
 
 
@@ -495,6 +1067,21 @@ async def unifi_update_traffic_matching_list(list_id: str, config: TrafficMatchi
     return await _api("PUT", f"/v1/sites/{_site(site_id)}/traffic-matching-lists/{_validate_id(list_id, 'list_id')}", body=config.model_dump(exclude_none=True))
 
 
+@mcp.tool(annotations={"idempotentHint": True})
+async def unifi_add_traffic_matching_list_items(list_id: str, items: list[dict], aggregate: bool = False, site_id: str | None = None) -> Any:
+    """Add items to a traffic matching list without resending the full list. Items already present are skipped.
+    Set aggregate=true to collapse overlapping/adjacent IP_ADDRESS and SUBNET entries. No PUT is made if nothing changes."""
+    return await _edit_traffic_matching_list(_site(site_id), _validate_id(list_id, "list_id"), add=items, aggregate=aggregate)
+
+
+@mcp.tool(annotations={"idempotentHint": True})
+async def unifi_remove_traffic_matching_list_items(list_id: str, items: list[dict], aggregate: bool = False, site_id: str | None = None) -> Any:
+    """Remove items from a traffic matching list without resending the full list. Missing items are ignored.
+    With aggregate=true, removing an address or subnet also carves it out of any larger SUBNET that covers it;
+    the response lists such carved_out items and the entries they replaced."""
+    return await _edit_traffic_matching_list(_site(site_id), _validate_id(list_id, "list_id"), remove=items, aggregate=aggregate)
+
+
 @mcp.tool(annotations={"destructiveHint": True})
 async def unifi_delete_traffic_matching_list(list_id: str, site_id: str | None = None) -> Any:
     """Delete a traffic matching list by ID."""
@@ -552,5 +1139,29 @@ async def unifi_list_countries() -> Any:
     return await _api("GET", "/v1/countries")
 
 
+# ── Tools: Exports ──
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+async def unifi_export_clients(format: str = "ndjson", filename: str | None = None, site_id: str | None = None) -> Any:
+    """Export every client at a site to a local file (ndjson|csv|parquet) under UNIFI_EXPORT_DIR.
+    Pages are streamed to disk; returns only the path, row count and sha256 checksum."""
+    return await _export("clients", f"/v1/sites/{_site(site_id)}/clients", format, filename)
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+async def unifi_export_devices(format: str = "ndjson", filename: str | None = None, site_id: str | None = None) -> Any:
+    """Export every adopted device at a site to a local file (ndjson|csv|parquet) under UNIFI_EXPORT_DIR.
+    Pages are streamed to disk; returns only the path, row count and sha256 checksum."""
+    return await _export("devices", f"/v1/sites/{_site(site_id)}/devices", format, filename)
+
+
+@mcp.tool(annotations={"readOnlyHint": True})
+async def unifi_export_vouchers(format: str = "ndjson", filename: str | None = None, site_id: str | None = None) -> Any:
+    """Export every hotspot voucher at a site to a local file (ndjson|csv|parquet) under UNIFI_EXPORT_DIR.
+    Pages are streamed to disk; returns only the path, row count and sha256 checksum."""
+    return await _export("vouchers", f"/v1/sites/{_site(site_id)}/hotspot/vouchers", format, filename)
+
+
 if __name__ == "__main__":
     mcp.run()